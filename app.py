@@ -2,29 +2,58 @@
 Main application entry point for Telegram Music Bot.
 """
 import asyncio
+import importlib
 import logging
+import os
 import signal
 import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from queue import SimpleQueue
+from typing import Tuple
 
 import aiohttp
 from aiohttp import web
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 from config import config
 from bot.client import BotClient
+from bot.persistence.storage import STATE_DB_NAME
+
+# Configure logging; records are written by a background listener thread
+# so the event loop never blocks on console or file I/O
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.StreamHandler(sys.stdout),
+    RotatingFileHandler('music_bot.log', maxBytes=10_000_000, backupCount=3, encoding='utf-8')
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, config.app.log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('music_bot.log')
-    ]
-)
+_log_queue = SimpleQueue()
+log_listener = QueueListener(_log_queue, *_log_handlers)
+
+_root_logger = logging.getLogger()
+_root_logger.setLevel(getattr(logging, config.app.log_level))
+_root_logger.addHandler(QueueHandler(_log_queue))
+log_listener.start()
 
 logger = logging.getLogger(__name__)
 
+CLEANUP_INTERVAL = 3600  # seconds between download cleanups
+
+# Files in the download directory holding live state, never swept: the state
+# database (a WAL db's mtime only moves on checkpoint) and Pyrogram sessions
+_PERSISTENT_PREFIXES = (STATE_DB_NAME,)
+_PERSISTENT_SUFFIXES = (".session", ".session-journal")
+
+PLUGINS = ("start", "play", "controls", "queue", "callbacks")
+
 
 async def health_check_handler(request):
     """Health check endpoint."""
@@ -35,7 +64,7 @@ async def health_check_handler(request):
         return web.json_response({
             "status": "ok",
             "bot_status": health,
-            "timestamp": asyncio.get_event_loop().time()
+            "timestamp": asyncio.get_running_loop().time()
         })
     except Exception as e:
         logger.error(f"Health check error: {e}")
@@ -57,14 +86,16 @@ async def index_handler(request):
 async def start_health_server():
     """Start the health check server."""
     try:
-        app = web.Application()
+        # Health probes never send a body
+        app = web.Application(client_max_size=1024)
         
         # Add bot client reference
         # This will be set later when bot client is created
         app.router.add_get('/', index_handler)
         app.router.add_get('/health', health_check_handler)
         
-        runner = web.AppRunner(app)
+        # Keep probe connections open between checks (matches nginx's 75s)
+        runner = web.AppRunner(app, keepalive_timeout=75)
         await runner.setup()
         
         site = web.TCPSite(runner, '0.0.0.0', config.app.port)
@@ -79,18 +110,23 @@ async def start_health_server():
         raise
 
 
-async def setup_signal_handlers(bot_client: BotClient):
+def setup_signal_handlers(bot_client: BotClient, stop_event: asyncio.Event):
     """Setup signal handlers for graceful shutdown."""
+    loop = asyncio.get_running_loop()
     
-    def signal_handler(signum, frame):
+    def signal_handler(signum):
         logger.info(f"Received signal {signum}, shutting down gracefully...")
-        asyncio.create_task(shutdown(bot_client))
+        asyncio.create_task(shutdown(bot_client, stop_event))
     
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, signal_handler, sig)
+        except NotImplementedError:
+            # Not supported by the Windows event loop
+            logger.warning(f"Cannot install handler for {sig}")
 
 
-async def shutdown(bot_client: BotClient):
+async def shutdown(bot_client: BotClient, stop_event: asyncio.Event):
     """Graceful shutdown handler."""
     logger.info("Starting graceful shutdown...")
     
@@ -104,27 +140,60 @@ async def shutdown(bot_client: BotClient):
         logger.error(f"Error during shutdown: {e}")
     
     finally:
-        # Exit
-        sys.exit(0)
+        # Wake up main() so it can finish cleanup
+        stop_event.set()
+
 
+def _sync_cleanup(download_dir: Path, cutoff: float) -> Tuple[int, float]:
+    """
+    Delete files last modified before cutoff (runs in a worker thread).
+    
+    Returns the number of removed files and the oldest surviving mtime.
+    """
+    removed = 0
+    oldest_mtime = float("inf")
+    
+    with os.scandir(download_dir) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            
+            if (entry.name.startswith(_PERSISTENT_PREFIXES)
+                    or entry.name.endswith(_PERSISTENT_SUFFIXES)):
+                continue
+            
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+            if mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                    removed += 1
+                    logger.info(f"Cleaned up old file: {entry.path}")
+                except OSError as e:
+                    logger.error(f"Failed to clean up {entry.path}: {e}")
+            elif mtime < oldest_mtime:
+                oldest_mtime = mtime
+    
+    return removed, oldest_mtime
 
-async def cleanup_downloads(download_dir: Path):
+
+async def cleanup_downloads(bot_client: BotClient, download_dir: Path, max_age_hours: int = 24):
     """Clean up old download files."""
     try:
-        import time
-        current_time = time.time()
-        max_age_hours = 24
-        
-        for file_path in download_dir.glob("*"):
-            if file_path.is_file():
-                file_age = current_time - file_path.stat().st_mtime
-                if file_age > (max_age_hours * 3600):
-                    try:
-                        file_path.unlink()
-                        logger.info(f"Cleaned up old file: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Failed to clean up {file_path}: {e}")
-                        
+        cutoff = time.time() - max_age_hours * 3600
+        
+        # Nothing was added or removed since the last scan and no known
+        # file has aged past the cutoff yet, so a rescan would be a no-op
+        dir_mtime = os.stat(download_dir).st_mtime
+        if (dir_mtime == bot_client.downloads_mtime
+                and bot_client.oldest_download_mtime >= cutoff):
+            logger.debug("Skipping cleanup, download directory unchanged")
+            return
+        
+        removed, oldest_mtime = await asyncio.to_thread(_sync_cleanup, download_dir, cutoff)
+        
+        bot_client.downloads_mtime = os.stat(download_dir).st_mtime
+        bot_client.oldest_download_mtime = oldest_mtime
+        
     except Exception as e:
         logger.error(f"Cleanup error: {e}")
 
@@ -132,15 +201,10 @@ async def cleanup_downloads(download_dir: Path):
 async def register_plugins(app, bot_client: BotClient):
     """Register all bot plugins."""
     try:
-        # Import plugins
-        from bot.plugins import start, play, controls, queue, callbacks
-        
-        # Register handlers
-        start.register_handlers(app, bot_client)
-        play.register_handlers(app, bot_client)
-        controls.register_handlers(app, bot_client)
-        queue.register_handlers(app, bot_client)
-        callbacks.register_handlers(app, bot_client)
+        # Import one after another; the plugins share parent packages, so
+        # parallel imports would only contend on the import locks
+        for name in PLUGINS:
+            importlib.import_module(f"bot.plugins.{name}").register_handlers(app, bot_client)
         
         logger.info("All plugins registered successfully")
         
@@ -155,14 +219,17 @@ async def main():
         logger.info("Starting Telegram Music Bot v2.1...")
         logger.info(config)
         
-        # Validate configuration
+        stop_event = asyncio.Event()
+        
+        # Validate configuration and create the download directory
         config.validate()
+        config.ensure_runtime_dirs()
         
         # Create bot client
         bot_client = BotClient()
         
         # Setup signal handlers
-        await setup_signal_handlers(bot_client)
+        setup_signal_handlers(bot_client, stop_event)
         
         # Start health check server
         health_runner = await start_health_server()
@@ -171,36 +238,49 @@ async def main():
         health_app = health_runner.app
         health_app['bot_client'] = bot_client
         
-        # Register plugins
-        await register_plugins(bot_client.bot, bot_client)
-        
         # Start bot
         await bot_client.start()
         
-        # Periodic cleanup
-        async def periodic_cleanup():
+        # Register plugins (the Pyrogram client exists only after start)
+        await register_plugins(bot_client.bot, bot_client)
+        
+        # Periodic cleanup, scheduled on absolute deadlines so slow runs don't drift
+        loop = asyncio.get_running_loop()
+        
+        def schedule_cleanup(deadline: float):
+            """Schedule the next cleanup of old files."""
+            bot_client.cleanup_handle = loop.call_at(deadline, start_cleanup, deadline)
+        
+        def start_cleanup(deadline: float):
+            """Start a cleanup run, keeping a reference so it can be cancelled."""
+            bot_client.cleanup_task = asyncio.create_task(periodic_cleanup(deadline))
+        
+        async def periodic_cleanup(deadline: float):
             """Periodic cleanup of old files."""
-            while True:
-                try:
-                    await asyncio.sleep(3600)  # Every hour
-                    await cleanup_downloads(config.app.download_dir)
-                except asyncio.CancelledError:
-                    break
-                except Exception as e:
-                    logger.error(f"Periodic cleanup error: {e}")
+            try:
+                await cleanup_downloads(bot_client, config.app.download_dir)
+                if bot_client.youtube:
+                    await bot_client.youtube.prune_metadata()
+            except Exception as e:
+                logger.error(f"Periodic cleanup error: {e}")
+            finally:
+                # Don't queue another run once shutdown has started
+                if bot_client.is_running:
+                    schedule_cleanup(deadline + CLEANUP_INTERVAL)
         
-        cleanup_task = asyncio.create_task(periodic_cleanup())
+        schedule_cleanup(loop.time() + CLEANUP_INTERVAL)
         
         logger.info("Bot is now running. Press Ctrl+C to stop.")
         
         # Keep the application running
         try:
-            await asyncio.Future()  # Run forever
-        except KeyboardInterrupt:
-            logger.info("Received keyboard interrupt")
+            await stop_event.wait()
         finally:
             # Cleanup
-            cleanup_task.cancel()
+            if bot_client.cleanup_handle:
+                bot_client.cleanup_handle.cancel()
+            if bot_client.cleanup_task:
+                bot_client.cleanup_task.cancel()
             await bot_client.stop()
             await health_runner.cleanup()
             
@@ -213,6 +293,10 @@ async def main():
 
 if __name__ == "__main__":
     try:
+        # Use uvloop's libuv-based event loop when available
+        if uvloop is not None:
+            uvloop.install()
+        
         # Run the application
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -220,3 +304,6 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"Application error: {e}")
         sys.exit(1)
+    finally:
+        # Flush queued log records
+        log_listener.stop()
@@ -3,24 +3,40 @@ Bot client initialization and management.
 """
 import asyncio
 import logging
+import time
+import weakref
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, Set, Tuple
 
 from pyrogram import Client as PyrogramClient
-from pyrogram.errors import ApiIdInvalid, ApiIdPublishedFlood
+from pyrogram.errors import ApiIdInvalid, ApiIdPublishedFlood, MessageNotModified
+from pyrogram.handlers import ChatMemberUpdatedHandler
 from pytgcalls import PyTgCalls
 from pytgcalls.exceptions import UnAuthorized
 
 from config import config
 from bot.core.player import Player
-from bot.core.queue import QueueManager
+from bot.core.queue import QueueManager, Track
 from bot.helpers.localization import Localization
 from bot.helpers.youtube import YouTubeHelper
-from bot.helpers.assistant import AssistantManager
+from bot.helpers.assistant import AssistantManager, ADMIN_STATUSES
 from bot.helpers.keyboards import KeyboardBuilder
 from bot.helpers.formatting import Formatter
 from bot.persistence.state import StateManager
-from bot.persistence.storage import create_storage_backend
+from bot.persistence.storage import create_storage_backend, STATE_DB_NAME
+
+# Maximum number of chats restored in parallel on startup
+RESTORE_CONCURRENCY = 8
+
+# Button presses handled at once per chat; further presses wait their turn
+CALLBACK_CONCURRENCY = 2
+# Seconds Telegram clients may reuse a silent button answer instead of re-sending the press
+CALLBACK_CACHE_TIME = 3
+
+# Seconds a user's admin status is trusted before asking Telegram again
+ADMIN_CACHE_TTL = 120
+# Admin statuses remembered at most
+ADMIN_CACHE_SIZE = 10_000
 
 
 class BotClient:
@@ -42,6 +58,29 @@ class BotClient:
         
         self.logger = logging.getLogger(__name__)
         self.is_running = False
+        
+        # Download directory scan cache used by the periodic cleanup
+        self.downloads_mtime: float = 0.0
+        self.oldest_download_mtime: float = 0.0
+        self.cleanup_handle: Optional[asyncio.TimerHandle] = None
+        self.cleanup_task: Optional[asyncio.Task] = None
+        
+        # Serializes now playing edits per chat to avoid flood limits
+        self._edit_locks: Dict[int, asyncio.Lock] = {}
+        # Now playing render per chat still waiting for its edit lock
+        self._np_pending: Dict[int, asyncio.Task] = {}
+        # Hash of the last now playing payload sent per chat
+        self._last_np_hash: Dict[int, int] = {}
+        # Chat titles shown in the now playing message
+        self._chat_names: Dict[int, str] = {}
+        # (chat_id, user_id) -> (expiry, is admin), oldest first
+        self._admin_cache: Dict[Tuple[int, int], Tuple[float, bool]] = {}
+        # Per-chat callback semaphores; an idle one is dropped with its last waiter
+        self._callback_slots: "weakref.WeakValueDictionary[int, asyncio.Semaphore]" = (
+            weakref.WeakValueDictionary()
+        )
+        # Button presses handled in the background, off pyrogram's workers
+        self._callback_tasks: Set[asyncio.Task] = set()
     
     async def initialize(self):
         """Initialize all bot components."""
@@ -51,14 +90,14 @@ class BotClient:
             # Initialize storage backend
             storage_backend = create_storage_backend(
                 config.database.backend,
-                config.app.download_dir / "state.db"
+                config.app.download_dir / STATE_DB_NAME
             )
             
             # Initialize localization
             self.localization = Localization()
             
             # Initialize YouTube helper
-            self.youtube = YouTubeHelper(config.app.download_dir)
+            self.youtube = YouTubeHelper(config.app.download_dir, storage_backend)
             
             # Initialize utilities
             self.keyboards = KeyboardBuilder()
@@ -114,17 +153,22 @@ class BotClient:
                 workdir=config.app.download_dir
             )
             
-            # Start clients
+            # Start both clients concurrently
             self.logger.info("Starting Pyrogram clients...")
-            await self.bot.start()
-            await self.assistant.start()
-            
-            # Verify bot token
-            bot_me = await self.bot.get_me()
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    tg.create_task(self.bot.start())
+                    tg.create_task(self.assistant.start())
+            except ExceptionGroup as eg:
+                # Surface the original error to the handlers below
+                raise eg.exceptions[0]
+            
+            # Verify bot token and assistant session
+            bot_me, assistant_me = await asyncio.gather(
+                self.bot.get_me(),
+                self.assistant.get_me()
+            )
             self.logger.info(f"Bot started: @{bot_me.username} ({bot_me.id})")
-            
-            # Verify assistant session
-            assistant_me = await self.assistant.get_me()
             self.logger.info(f"Assistant started: @{assistant_me.username} ({assistant_me.id})")
             
         except ApiIdInvalid:
@@ -161,38 +205,142 @@ class BotClient:
         """Register event handlers."""
         if self.player:
             self.player.register_handlers(on_stream_end=self._on_stream_end)
+        
+        if self.bot:
+            self.bot.add_handler(ChatMemberUpdatedHandler(self._on_chat_member_updated))
+    
+    async def _on_chat_member_updated(self, client: PyrogramClient, update):
+        """Forget a member's cached admin status once it changes."""
+        member = update.new_chat_member or update.old_chat_member
+        if member and member.user:
+            self._admin_cache.pop((update.chat.id, member.user.id), None)
     
     async def _on_stream_end(self, chat_id: int):
         """Handle stream end event."""
         try:
             self.logger.info(f"Stream ended for chat {chat_id}, getting next track...")
             
-            # Auto-play next track
-            next_track = self.queue_manager.auto_next(chat_id)
-            
-            if next_track and self.player:
-                # Start next track
-                success = await self.player.play_audio(
-                    chat_id, 
-                    next_track.file_path
-                )
+            async with self.queue_manager.lock(chat_id):
+                # Auto-play next track
+                next_track = self.queue_manager.auto_next(chat_id)
                 
-                if success:
-                    # Update now playing message
-                    await self._update_now_playing_message(chat_id)
+                if next_track and self.player:
+                    # Start next track
+                    success = await self.player.play_audio(
+                        chat_id, 
+                        next_track.file_path
+                    )
+                    
+                    if success:
+                        # Update now playing message
+                        await self._update_now_playing_message(chat_id)
+                    else:
+                        self.logger.error(f"Failed to start next track for chat {chat_id}")
                 else:
-                    self.logger.error(f"Failed to start next track for chat {chat_id}")
-            else:
-                self.logger.info(f"No more tracks for chat {chat_id}")
-                # Stop progress updater
-                if self.player:
-                    await self.player.stop_progress_updater(chat_id)
+                    self.logger.info(f"No more tracks for chat {chat_id}")
+                    # Stop progress updater; the now playing message is done
+                    if self.player:
+                        await self.player.stop_progress_updater(chat_id)
+                    self._last_np_hash.pop(chat_id, None)
                 
         except Exception as e:
             self.logger.error(f"Error handling stream end for chat {chat_id}: {e}")
     
+    async def end_session(self, chat_id: int):
+        """Stop playback in a chat: leave the voice chat, stop auto-save, clear the queue."""
+        # leave_voice_chat also drops the player's per-chat state, so a separate
+        # stop_playback would only repeat its leave_group_call
+        await asyncio.gather(
+            self.player.leave_voice_chat(chat_id),
+            self.state_manager.stop_auto_save(chat_id)
+        )
+        self.queue_manager.clear_queue(chat_id)
+        
+        # Release the chat's now playing state; a render still waiting for
+        # the edit lock has nothing left to show
+        pending = self._np_pending.pop(chat_id, None)
+        if pending is not None:
+            pending.cancel()
+        self._edit_locks.pop(chat_id, None)
+        self._chat_names.pop(chat_id, None)
+        self._last_np_hash.pop(chat_id, None)
+    
+    async def is_chat_admin(self, chat_id: int, user_id: int) -> bool:
+        """Check if a user administers a chat, caching the answer briefly."""
+        key = (chat_id, user_id)
+        now = time.monotonic()
+        
+        cached = self._admin_cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        
+        member = await self.bot.get_chat_member(chat_id, user_id)
+        is_admin = member.status in ADMIN_STATUSES
+        
+        # Re-insert so the dict stays ordered by expiry
+        self._admin_cache.pop(key, None)
+        self._admin_cache[key] = (now + ADMIN_CACHE_TTL, is_admin)
+        if len(self._admin_cache) > ADMIN_CACHE_SIZE:
+            del self._admin_cache[next(iter(self._admin_cache))]
+        
+        return is_admin
+    
+    def callback_slot(self, callback) -> asyncio.Semaphore:
+        """Get the semaphore bounding concurrent callback handling in a chat."""
+        chat_id = callback.message.chat.id if callback.message else callback.from_user.id
+        
+        slot = self._callback_slots.get(chat_id)
+        if slot is None:
+            slot = self._callback_slots[chat_id] = asyncio.Semaphore(CALLBACK_CONCURRENCY)
+        return slot
+    
+    def dispatch_callback(self, callback, handler, *args) -> asyncio.Task:
+        """Handle a button press in the background so a slow chat doesn't hold up others."""
+        task = asyncio.create_task(self._run_callback(callback, handler, *args))
+        self._callback_tasks.add(task)
+        task.add_done_callback(self._callback_tasks.discard)
+        return task
+    
+    async def _run_callback(self, callback, handler, *args):
+        """Run a callback handler once its chat has a free slot."""
+        try:
+            # The slot keeps presses within one chat bounded and in order
+            async with self.callback_slot(callback):
+                await handler(*args)
+        except Exception as e:
+            self.logger.error(f"Error handling callback {callback.data}: {e}")
+    
     async def _update_now_playing_message(self, chat_id: int):
-        """Update now playing message."""
+        """Update now playing message, coalescing bursts of updates."""
+        # A render that has not started yet will show the latest state, so
+        # join it instead of queueing another edit behind it
+        pending = self._np_pending.get(chat_id)
+        if pending is None:
+            pending = self._np_pending[chat_id] = asyncio.ensure_future(
+                self._locked_render(chat_id)
+            )
+        
+        # Shielded so one cancelled caller doesn't cancel the shared render
+        try:
+            await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            # end_session dropped the render; only our own cancellation propagates
+            if not pending.cancelled():
+                raise
+    
+    async def _locked_render(self, chat_id: int):
+        """Render the now playing message under the chat's edit lock."""
+        lock = self._edit_locks.get(chat_id)
+        if lock is None:
+            lock = self._edit_locks[chat_id] = asyncio.Lock()
+        
+        async with lock:
+            # From here on, later updates need a render of their own
+            self._np_pending.pop(chat_id, None)
+            await self._render_now_playing_message(chat_id)
+    
+    async def _render_now_playing_message(self, chat_id: int):
+        """Render and send or edit the now playing message."""
         try:
             if not self.player or not self.localization:
                 return
@@ -201,32 +349,22 @@ class BotClient:
             if not current_track:
                 return
             
-            # Get chat info
-            chat = await self.bot.get_chat(chat_id)
-            chat_name = chat.title or "Private Chat"
-            
-            # Calculate current position
-            current_pos = int(self.player.get_current_position(chat_id))
+            # Get chat name (cached, it only changes on chat renames)
+            chat_name = self._chat_names.get(chat_id)
+            if chat_name is None:
+                chat = await self.bot.get_chat(chat_id)
+                chat_name = self._chat_names[chat_id] = chat.title or "Private Chat"
             
-            # Format message
-            formatted = self.formatter.format_now_playing(
-                current_track.to_dict(),
-                current_pos,
-                chat_name,
-                self.localization,
-                chat_id
-            )
-            
-            # Build keyboard
-            keyboard = self.keyboards.build_playback_controls(
-                chat_id,
-                self.player.is_playing(chat_id),
-                self.localization
-            )
+            formatted, keyboard = self._build_now_playing(chat_id, current_track, chat_name)
             
             # Send or edit message
             message_id = self.player.current_messages.get(chat_id)
             if message_id:
+                # Skip the edit if the message already shows this payload
+                payload_hash = self._now_playing_hash(message_id, formatted, keyboard)
+                if self._last_np_hash.get(chat_id) == payload_hash:
+                    return
+                
                 try:
                     await self.bot.edit_message_text(
                         chat_id,
@@ -234,6 +372,8 @@ class BotClient:
                         formatted,
                         reply_markup=keyboard
                     )
+                except MessageNotModified:
+                    pass
                 except Exception:
                     # Message might be deleted, send new one
                     message = await self.bot.send_message(
@@ -241,7 +381,7 @@ class BotClient:
                         formatted,
                         reply_markup=keyboard
                     )
-                    self.player.current_messages[chat_id] = message.id
+                    message_id = self.player.current_messages[chat_id] = message.id
             else:
                 # Send new message
                 message = await self.bot.send_message(
@@ -249,11 +389,46 @@ class BotClient:
                     formatted,
                     reply_markup=keyboard
                 )
-                self.player.current_messages[chat_id] = message.id
+                message_id = self.player.current_messages[chat_id] = message.id
+            
+            self._last_np_hash[chat_id] = self._now_playing_hash(message_id, formatted, keyboard)
                 
         except Exception as e:
             self.logger.error(f"Failed to update now playing message for chat {chat_id}: {e}")
     
+    def _build_now_playing(self, chat_id: int, track: Track, chat_name: str):
+        """Build now playing text and keyboard."""
+        # Calculate current position
+        current_pos = int(self.player.get_current_position(chat_id))
+        
+        # Format message
+        formatted = self.formatter.format_now_playing(
+            track.to_dict(),
+            current_pos,
+            chat_name,
+            self.localization,
+            chat_id
+        )
+        
+        # Build keyboard
+        keyboard = self.keyboards.build_playback_controls(
+            chat_id,
+            self.player.is_playing(chat_id),
+            self.localization
+        )
+        
+        return formatted, keyboard
+    
+    @staticmethod
+    def _now_playing_hash(message_id: int, text: str, keyboard) -> int:
+        """Hash a now playing payload for change detection."""
+        buttons = tuple(
+            (button.text, button.callback_data)
+            for row in keyboard.inline_keyboard
+            for button in row
+        )
+        return hash((message_id, text, buttons))
+    
     async def start(self):
         """Start the bot."""
         if self.is_running:
@@ -288,6 +463,10 @@ class BotClient:
             
             self.is_running = False
             
+            # Drop button presses still in flight before their clients go away
+            for task in list(self._callback_tasks):
+                task.cancel()
+            
             # Stop all components
             if self.pytgcalls:
                 await self.pytgcalls.stop()
@@ -300,8 +479,8 @@ class BotClient:
             
             # Clean up state managers
             if self.state_manager:
-                for chat_id in list(self.state_manager.save_tasks.keys()):
-                    await self.state_manager.stop_auto_save(chat_id)
+                await self.state_manager.stop_all_auto_saves()
+                await self.state_manager.storage.close()
             
             self.logger.info("Bot stopped successfully")
             
@@ -318,41 +497,54 @@ class BotClient:
             
             restored_states = await self.state_manager.restore_playback_states()
             
-            for chat_id, state_data in restored_states.items():
-                try:
-                    track_info = state_data.get("track", {})
-                    position = state_data.get("restored_position", 0)
-                    
-                    self.logger.info(f"Restoring playback for chat {chat_id}: {track_info.get('title', 'Unknown')}")
-                    
-                    # Start playback
-                    if self.player:
-                        success = await self.player.play_audio(
-                            chat_id,
-                            track_info.get("file_path", ""),
-                            resume_from=position
-                        )
-                        
-                        if success:
-                            # Start progress updater
-                            await self._update_now_playing_message(chat_id)
-                            
-                            # Send restoration message
-                            await self.bot.send_message(
-                                chat_id,
-                                self.localization.get_text(chat_id, "status_messages.bot_restarted")
-                            )
-                        else:
-                            self.logger.error(f"Failed to restore playback for chat {chat_id}")
-                
-                except Exception as e:
-                    self.logger.error(f"Failed to restore state for chat {chat_id}: {e}")
+            # Restore chats concurrently, capping parallel voice chat joins
+            semaphore = asyncio.Semaphore(RESTORE_CONCURRENCY)
+            
+            async def restore_one(chat_id: int, state_data: dict):
+                async with semaphore:
+                    await self._restore_playback_state(chat_id, state_data)
+            
+            await asyncio.gather(
+                *(restore_one(chat_id, state_data) for chat_id, state_data in restored_states.items()),
+                return_exceptions=True
+            )
             
             self.logger.info("Playback state restoration completed")
             
         except Exception as e:
             self.logger.error(f"Error during state restoration: {e}")
     
+    async def _restore_playback_state(self, chat_id: int, state_data: dict):
+        """Restore saved playback state for a single chat."""
+        try:
+            track_info = state_data.get("track", {})
+            position = state_data.get("restored_position", 0)
+            
+            self.logger.info(f"Restoring playback for chat {chat_id}: {track_info.get('title', 'Unknown')}")
+            
+            # Start playback
+            if self.player:
+                success = await self.player.play_audio(
+                    chat_id,
+                    track_info.get("file_path", ""),
+                    resume_from=position
+                )
+                
+                if success:
+                    # Start progress updater
+                    await self._update_now_playing_message(chat_id)
+                    
+                    # Send restoration message
+                    await self.bot.send_message(
+                        chat_id,
+                        self.localization.get_text(chat_id, "status_messages.bot_restarted")
+                    )
+                else:
+                    self.logger.error(f"Failed to restore playback for chat {chat_id}")
+        
+        except Exception as e:
+            self.logger.error(f"Failed to restore state for chat {chat_id}: {e}")
+    
     async def health_check(self) -> dict:
         """Get bot health status."""
         try:
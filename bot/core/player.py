@@ -3,8 +3,9 @@ Music player module for managing voice chat playback.
 """
 import asyncio
 import logging
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Set
 
 from pytgcalls import PyTgCalls
 from pytgcalls.exceptions import (
@@ -23,6 +24,30 @@ from pytgcalls.types import (
 
 logger = logging.getLogger(__name__)
 
+PROGRESS_UPDATE_INTERVAL = 15  # seconds between now playing refreshes
+
+
+@dataclass(slots=True)
+class PlaybackState:
+    """Playback state of a single chat."""
+    file_path: str
+    start_time: float
+    resume_from: int = 0
+    is_playing: bool = True
+    paused_at: Optional[float] = None
+    resume_at: Optional[float] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert playback state to dictionary."""
+        return {
+            'file_path': self.file_path,
+            'start_time': self.start_time,
+            'resume_from': self.resume_from,
+            'is_playing': self.is_playing,
+            'paused_at': self.paused_at,
+            'resume_at': self.resume_at
+        }
+
 
 class Player:
     """Music player with PyTgCalls integration."""
@@ -30,9 +55,18 @@ class Player:
     def __init__(self, pytgcalls: PyTgCalls):
         """Initialize the player."""
         self.pytgcalls = pytgcalls
-        self.progress_updaters: Dict[int, asyncio.Task] = {}
-        self.playback_state: Dict[int, Dict[str, Any]] = {}
+        self.progress_updaters: Dict[int, asyncio.TimerHandle] = {}
+        self._last_rendered: Dict[int, int] = {}  # chat_id -> last rendered position
+        self._update_tasks: Set[asyncio.Task] = set()
+        self.playback_state: Dict[int, PlaybackState] = {}
         self.current_messages: Dict[int, int] = {}  # chat_id -> message_id
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def _now(self) -> float:
+        """Get the event loop's monotonic time."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        return self._loop.time()
     
     async def join_voice_chat(self, chat_id: int) -> bool:
         """Join a voice chat."""
@@ -58,9 +92,10 @@ class Player:
                 self.progress_updaters[chat_id].cancel()
                 del self.progress_updaters[chat_id]
             
-            # Clean up message reference
-            if chat_id in self.current_messages:
-                del self.current_messages[chat_id]
+            # Clean up message reference and any per-chat playback state
+            self.current_messages.pop(chat_id, None)
+            self._last_rendered.pop(chat_id, None)
+            self.playback_state.pop(chat_id, None)
             
             return True
         except Exception as e:
@@ -85,12 +120,11 @@ class Player:
             )
             
             # Save playback state
-            self.playback_state[chat_id] = {
-                'file_path': str(file_path),
-                'start_time': asyncio.get_event_loop().time(),
-                'resume_from': resume_from,
-                'is_playing': True
-            }
+            self.playback_state[chat_id] = PlaybackState(
+                file_path=str(file_path),
+                start_time=self._now(),
+                resume_from=resume_from
+            )
             
             logger.info(f"Started playback in {chat_id}: {file_path}")
             return True
@@ -104,9 +138,10 @@ class Player:
         try:
             await self.pytgcalls.pause_group_call(chat_id)
             
-            if chat_id in self.playback_state:
-                self.playback_state[chat_id]['is_playing'] = False
-                self.playback_state[chat_id]['paused_at'] = asyncio.get_event_loop().time()
+            state = self.playback_state.get(chat_id)
+            if state is not None:
+                state.is_playing = False
+                state.paused_at = self._now()
             
             logger.info(f"Paused playback in {chat_id}")
             return True
@@ -119,9 +154,10 @@ class Player:
         try:
             await self.pytgcalls.resume_group_call(chat_id)
             
-            if chat_id in self.playback_state:
-                self.playback_state[chat_id]['is_playing'] = True
-                self.playback_state[chat_id]['resume_at'] = asyncio.get_event_loop().time()
+            state = self.playback_state.get(chat_id)
+            if state is not None:
+                state.is_playing = True
+                state.resume_at = self._now()
             
             logger.info(f"Resumed playback in {chat_id}")
             return True
@@ -160,24 +196,25 @@ class Player:
     
     def get_current_position(self, chat_id: int) -> float:
         """Get current playback position in seconds."""
-        if chat_id not in self.playback_state:
+        state = self.playback_state.get(chat_id)
+        if state is None:
             return 0.0
         
-        state = self.playback_state[chat_id]
-        if not state.get('is_playing', False):
-            return state.get('resume_from', 0.0)
+        if not state.is_playing:
+            return state.resume_from
         
-        current_time = asyncio.get_event_loop().time()
-        elapsed = current_time - state['start_time']
-        return state['resume_from'] + elapsed
+        current_time = self._now()
+        elapsed = current_time - state.start_time
+        return state.resume_from + elapsed
     
-    def get_playback_state(self, chat_id: int) -> Optional[Dict[str, Any]]:
+    def get_playback_state(self, chat_id: int) -> Optional[PlaybackState]:
         """Get current playback state."""
         return self.playback_state.get(chat_id)
     
     def is_playing(self, chat_id: int) -> bool:
         """Check if music is currently playing."""
-        return chat_id in self.playback_state and self.playback_state[chat_id].get('is_playing', False)
+        state = self.playback_state.get(chat_id)
+        return state is not None and state.is_playing
     
     async def start_progress_updater(self, chat_id: int, message_id: int, update_func):
         """Start periodic progress updates for now playing message."""
@@ -186,18 +223,43 @@ class Player:
         
         # Store message reference
         self.current_messages[chat_id] = message_id
+        self._last_rendered[chat_id] = int(self.get_current_position(chat_id))
         
-        async def updater():
-            while chat_id in self.progress_updaters:
-                try:
-                    if chat_id in self.current_messages:
-                        await update_func(chat_id, self.current_messages[chat_id])
-                except Exception as e:
-                    logger.error(f"Progress updater error for {chat_id}: {e}")
-                
-                await asyncio.sleep(15)  # Update every 15 seconds
+        self._schedule_progress_tick(chat_id, update_func, self._now() + PROGRESS_UPDATE_INTERVAL)
+    
+    def _schedule_progress_tick(self, chat_id: int, update_func, deadline: float):
+        """Schedule the next progress tick for a chat at an absolute loop time."""
+        self.progress_updaters[chat_id] = self._loop.call_at(
+            deadline, self._progress_tick, chat_id, update_func, deadline
+        )
+    
+    def _progress_tick(self, chat_id: int, update_func, deadline: float):
+        """Refresh the now playing message if the position has moved."""
+        if chat_id not in self.progress_updaters:
+            return
+        
+        # Reschedule from the previous deadline so ticks don't drift
+        self._schedule_progress_tick(chat_id, update_func, deadline + PROGRESS_UPDATE_INTERVAL)
+        
+        if chat_id not in self.current_messages:
+            return
+        
+        # Skip the edit when nothing visible has changed (e.g. paused)
+        position = int(self.get_current_position(chat_id))
+        if self._last_rendered.get(chat_id) == position:
+            return
+        self._last_rendered[chat_id] = position
         
-        self.progress_updaters[chat_id] = asyncio.create_task(updater())
+        task = asyncio.create_task(self._run_progress_update(chat_id, update_func))
+        self._update_tasks.add(task)
+        task.add_done_callback(self._update_tasks.discard)
+    
+    async def _run_progress_update(self, chat_id: int, update_func):
+        """Run a single progress update."""
+        try:
+            await update_func(chat_id)
+        except Exception as e:
+            logger.error(f"Progress updater error for {chat_id}: {e}")
     
     async def stop_progress_updater(self, chat_id: int):
         """Stop progress updater for a chat."""
@@ -205,6 +267,8 @@ class Player:
             self.progress_updaters[chat_id].cancel()
             del self.progress_updaters[chat_id]
         
+        self._last_rendered.pop(chat_id, None)
+        
         if chat_id in self.current_messages:
             del self.current_messages[chat_id]
     
@@ -2,15 +2,23 @@
 Queue management module for per-chat music queues.
 """
 import asyncio
+import functools
 import logging
+import weakref
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Any
-from collections import defaultdict
+from typing import List, Dict, Optional, Any, Deque, Mapping
+from collections import defaultdict, deque
+from itertools import count, islice
+from random import shuffle
+from types import MappingProxyType
 
 logger = logging.getLogger(__name__)
 
+# Tracks shown per queue page
+QUEUE_PAGE_SIZE = 10
 
-@dataclass
+
+@dataclass(slots=True)
 class Track:
     """Represents a music track."""
     file_path: str
@@ -41,40 +49,69 @@ class QueueManager:
     
     def __init__(self):
         """Initialize queue manager."""
-        self.queues: Dict[int, List[Track]] = defaultdict(list)
+        self.queues: Dict[int, Deque[Track]] = defaultdict(deque)
         self.current_index: Dict[int, int] = defaultdict(lambda: -1)
         self.loop_tracks: Dict[int, bool] = defaultdict(bool)
-        self.shuffle_mode: Dict[int, bool] = defaultdict(False)
+        self.shuffle_mode: Dict[int, bool] = defaultdict(bool)
+        self._total_duration: Dict[int, int] = defaultdict(int)
+        # Set from one shared counter on every mutation so cached pages go
+        # stale; numbers are never reused, so a cleared chat's entry can go
+        self._version: Dict[int, int] = {}
+        self._mutations = count(1)
+        self._page_cache = functools.lru_cache(maxsize=256)(self._build_page)
+        # Per-chat queue locks; an idle one is dropped with its last holder or waiter
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+    
+    def lock(self, chat_id: int) -> asyncio.Lock:
+        """
+        Get the per-chat queue lock.
+        
+        Queue methods are synchronous and atomic on the event loop; hold this
+        lock across sequences that read the queue and then await player I/O
+        (skip, auto-next, first-track start) so they cannot interleave.
+        """
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        return lock
     
     def add_track(self, chat_id: int, track: Track) -> int:
         """Add a track to the queue."""
         self.queues[chat_id].append(track)
+        self._total_duration[chat_id] += track.duration
+        self._version[chat_id] = next(self._mutations)
         index = len(self.queues[chat_id]) - 1
-        logger.info(f"Added track to queue {chat_id}: {track.title}")
+        logger.info("Added track to queue %s: %s", chat_id, track.title)
         return index
     
     def add_tracks(self, chat_id: int, tracks: List[Track]) -> List[int]:
         """Add multiple tracks to the queue."""
-        indexes = []
-        for track in tracks:
-            index = self.add_track(chat_id, track)
-            indexes.append(index)
-        return indexes
+        queue = self.queues[chat_id]
+        base = len(queue)
+        queue.extend(tracks)
+        self._total_duration[chat_id] += sum(track.duration for track in tracks)
+        self._version[chat_id] = next(self._mutations)
+        logger.info("Added %s tracks to queue %s", len(tracks), chat_id)
+        return list(range(base, base + len(tracks)))
     
     def get_current_track(self, chat_id: int) -> Optional[Track]:
         """Get current playing track."""
-        if not self.queues[chat_id]:
+        # Reads use .get so they don't recreate entries clear_queue dropped
+        queue = self.queues.get(chat_id)
+        if not queue:
             return None
         
-        current_idx = self.current_index[chat_id]
-        if current_idx == -1 or current_idx >= len(self.queues[chat_id]):
+        current_idx = self.current_index.get(chat_id, -1)
+        if current_idx == -1 or current_idx >= len(queue):
             return None
         
-        return self.queues[chat_id][current_idx]
+        return queue[current_idx]
     
     def get_next_track(self, chat_id: int) -> Optional[Track]:
         """Get next track in queue."""
-        if not self.queues[chat_id]:
+        if not self.queues.get(chat_id):
             return None
         
         current_idx = self.current_index[chat_id]
@@ -93,7 +130,7 @@ class QueueManager:
     
     def get_previous_track(self, chat_id: int) -> Optional[Track]:
         """Get previous track in queue."""
-        if not self.queues[chat_id]:
+        if not self.queues.get(chat_id):
             return None
         
         current_idx = self.current_index[chat_id]
@@ -112,18 +149,23 @@ class QueueManager:
     
     def skip_to_track(self, chat_id: int, index: int) -> Optional[Track]:
         """Skip to a specific track in queue."""
-        if not self.queues[chat_id] or index < 0 or index >= len(self.queues[chat_id]):
+        queue = self.queues.get(chat_id)
+        if not queue or index < 0 or index >= len(queue):
             return None
         
         self.current_index[chat_id] = index
-        return self.queues[chat_id][index]
+        return queue[index]
     
     def remove_track(self, chat_id: int, index: int) -> bool:
         """Remove a track from queue."""
-        if not self.queues[chat_id] or index < 0 or index >= len(self.queues[chat_id]):
+        queue = self.queues.get(chat_id)
+        if not queue or index < 0 or index >= len(queue):
             return False
         
-        removed = self.queues[chat_id].pop(index)
+        removed = queue[index]
+        del queue[index]
+        self._total_duration[chat_id] -= removed.duration
+        self._version[chat_id] = next(self._mutations)
         
         # Adjust current index if necessary
         current_idx = self.current_index[chat_id]
@@ -131,43 +173,49 @@ class QueueManager:
             self.current_index[chat_id] = current_idx - 1
         elif index == current_idx:
             # Removed current track
-            if index >= len(self.queues[chat_id]):
+            if index >= len(queue):
                 # Was last track, go to previous
                 self.current_index[chat_id] = max(0, index - 1)
             # else stay at current index (which now points to next track)
         
-        logger.info(f"Removed track from queue {chat_id}: {removed.title}")
+        logger.info("Removed track from queue %s: %s", chat_id, removed.title)
         return True
     
     def clear_queue(self, chat_id: int):
         """Clear all tracks from queue."""
-        self.queues[chat_id].clear()
-        self.current_index[chat_id] = -1
-        logger.info(f"Cleared queue for chat {chat_id}")
+        # Drop the chat's entries rather than keeping empty ones around; the
+        # defaultdicts recreate them on next write. An empty queue has no
+        # version, and the next mutation takes a number no cached page has.
+        self.queues.pop(chat_id, None)
+        self._total_duration.pop(chat_id, None)
+        self.current_index.pop(chat_id, None)
+        self._version.pop(chat_id, None)
+        logger.info("Cleared queue for chat %s", chat_id)
     
     def shuffle_queue(self, chat_id: int) -> bool:
         """Shuffle queue."""
-        if len(self.queues[chat_id]) <= 1:
+        if self.get_queue_length(chat_id) <= 1:
             return False
         
         current_track = self.get_current_track(chat_id)
         
-        # Shuffle everything except current track
-        remaining = self.queues[chat_id][self.current_index[chat_id] + 1:]
-        import random
-        random.shuffle(remaining)
-        
-        # Rebuild queue
-        self.queues[chat_id] = self.queues[chat_id][:self.current_index[chat_id] + 1] + remaining
+        # Shuffle everything after the current track in place; popping the
+        # tail off the right end reverses it, which the shuffle makes moot
+        queue = self.queues[chat_id]
+        tail_length = len(queue) - (self.current_index[chat_id] + 1)
+        remaining = [queue.pop() for _ in range(tail_length)]
+        shuffle(remaining)
+        queue.extend(remaining)
+        self._version[chat_id] = next(self._mutations)
         
         self.shuffle_mode[chat_id] = True
-        logger.info(f"Shuffled queue for chat {chat_id}")
+        logger.info("Shuffled queue for chat %s", chat_id)
         return True
     
     def set_loop_mode(self, chat_id: int, enabled: bool):
         """Set loop mode for queue."""
         self.loop_tracks[chat_id] = enabled
-        logger.info(f"Set loop mode to {enabled} for chat {chat_id}")
+        logger.info("Set loop mode to %s for chat %s", enabled, chat_id)
     
     def is_looping(self, chat_id: int) -> bool:
         """Check if loop mode is enabled."""
@@ -179,48 +227,54 @@ class QueueManager:
     
     def get_queue_info(self, chat_id: int) -> Dict[str, Any]:
         """Get queue information."""
-        queue = self.queues[chat_id]
-        current_idx = self.current_index[chat_id]
-        
-        # Calculate total duration
-        total_duration = sum(track.duration for track in queue)
+        queue = self.queues.get(chat_id, ())
+        current_idx = self.current_index.get(chat_id, -1)
         
         return {
             'total_tracks': len(queue),
             'current_index': current_idx,
             'current_track': self.get_current_track(chat_id) if current_idx != -1 else None,
-            'total_duration': total_duration,
+            'total_duration': self._total_duration.get(chat_id, 0),
             'is_looping': self.loop_tracks[chat_id],
             'is_shuffling': self.shuffle_mode[chat_id],
             'queue': queue
         }
     
-    def get_page(self, chat_id: int, page: int = 0, page_size: int = 10) -> Dict[str, Any]:
-        """Get paginated queue."""
-        queue = self.queues[chat_id]
+    def get_version(self, chat_id: int) -> int:
+        """Get the queue's version, changed on every mutation (0 when empty)."""
+        return self._version.get(chat_id, 0)
+    
+    def get_page(self, chat_id: int, page: int = 0, page_size: int = QUEUE_PAGE_SIZE) -> Mapping[str, Any]:
+        """Get paginated queue (cached until the queue changes)."""
+        return self._page_cache(chat_id, page, page_size, self.get_version(chat_id))
+    
+    def _build_page(self, chat_id: int, page: int, page_size: int, version: int) -> Mapping[str, Any]:
+        """Build a read-only page of the queue."""
+        queue = self.queues.get(chat_id, ())
         total_pages = (len(queue) + page_size - 1) // page_size
         
         start_idx = page * page_size
         end_idx = start_idx + page_size
         
-        page_tracks = queue[start_idx:end_idx]
+        page_tracks = tuple(islice(queue, start_idx, end_idx))
         
-        return {
+        return MappingProxyType({
             'tracks': page_tracks,
             'page': page,
             'total_pages': total_pages,
             'total_tracks': len(queue),
             'has_previous': page > 0,
             'has_next': page < total_pages - 1
-        }
+        })
     
     def start_playback(self, chat_id: int) -> Optional[Track]:
         """Start playback from beginning of queue."""
-        if not self.queues[chat_id]:
+        queue = self.queues.get(chat_id)
+        if not queue:
             return None
         
         self.current_index[chat_id] = 0
-        return self.queues[chat_id][0]
+        return queue[0]
     
     def auto_next(self, chat_id: int) -> Optional[Track]:
         """Automatically move to next track."""
@@ -228,8 +282,8 @@ class QueueManager:
     
     def get_queue_length(self, chat_id: int) -> int:
         """Get queue length."""
-        return len(self.queues[chat_id])
+        return len(self.queues.get(chat_id, ()))
     
     def is_empty(self, chat_id: int) -> bool:
         """Check if queue is empty."""
-        return len(self.queues[chat_id]) == 0
+        return not self.queues.get(chat_id)
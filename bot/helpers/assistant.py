@@ -3,9 +3,11 @@ Assistant management helper for auto-invite and promotion.
 """
 import asyncio
 import logging
+from types import MappingProxyType
 from typing import Optional
 
 from pyrogram import Client
+from pyrogram.enums import ChatMemberStatus
 from pyrogram.errors import (
     UserNotParticipant, 
     ChatAdminRequired, 
@@ -13,10 +15,55 @@ from pyrogram.errors import (
     ChatAdminPrivilegesRequired,
     PeerIdInvalid
 )
-from pyrogram.types import ChatPrivileges
+from pyrogram.types import ChatMember, ChatPrivileges
 
 logger = logging.getLogger(__name__)
 
+# Privileges granted to the assistant so it can manage voice chats
+PROMOTE_PRIVILEGES = ChatPrivileges(
+    can_manage_video_chats=True,
+    can_manage_chat=True,
+    can_change_info=False,
+    can_delete_messages=False,
+    can_invite_users=False,
+    can_restrict_members=False,
+    can_pin_messages=False,
+    can_promote_members=False
+)
+
+# Privileges used to strip the assistant of all admin rights
+DEMOTE_PRIVILEGES = ChatPrivileges(
+    can_manage_video_chats=False,
+    can_manage_chat=False,
+    can_change_info=False,
+    can_delete_messages=False,
+    can_invite_users=False,
+    can_restrict_members=False,
+    can_pin_messages=False,
+    can_promote_members=False
+)
+
+# Admin rights the bot itself needs
+REQUIRED_ADMIN_RIGHTS = MappingProxyType({
+    "can_manage_video_chats": True,
+    "can_manage_chat": True,
+    "can_change_info": False,
+    "can_delete_messages": False,
+    "can_invite_users": True,
+    "can_restrict_members": False,
+    "can_pin_messages": False,
+    "can_promote_members": False
+})
+
+# Member statuses meaning "not in the chat" and "has admin rights"
+ABSENT_STATUSES = frozenset({ChatMemberStatus.LEFT, ChatMemberStatus.BANNED})
+ADMIN_STATUSES = frozenset({ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER})
+
+# Polling for the assistant to show up after an invite; the sleeps add up
+# to at most the budget, the fixed wait this polling replaced
+JOIN_POLL_BUDGET = 2.0  # seconds
+JOIN_POLL_INITIAL_DELAY = 0.25  # seconds, doubled after each attempt
+
 
 class AssistantManager:
     """Manages assistant user operations."""
@@ -26,6 +73,61 @@ class AssistantManager:
         self.assistant_username = assistant_username
         self.bot = bot
         self.assistant = assistant
+        self._assistant_id: Optional[int] = None
+        self._resolve_lock = asyncio.Lock()
+        
+        # User-facing messages only depend on the assistant username
+        self._privacy_message = (
+            f"🤖 The music assistant (@{assistant_username}) has privacy restrictions.\n\n"
+            "To use the music bot, please:\n"
+            f"1. Add @{assistant_username} to the chat manually, or\n"
+            "2. Ask the assistant to disable their privacy settings"
+        )
+        self._setup_instructions = (
+            "🤖 **Music Bot Setup Instructions**\n\n"
+            "To use the music bot, I need the following:\n\n"
+            "1️⃣ **Admin Rights for Bot:**\n"
+            "   • Make the bot an administrator\n"
+            "   • Grant 'Manage Video Chats' permission\n"
+            "   • Allow adding members\n\n"
+            "2️⃣ **Add Music Assistant:**\n"
+            f"   • Add @{assistant_username} to the chat\n"
+            "   • Grant 'Manage Video Chats' permission\n\n"
+            "3️⃣ **Start Voice Chat:**\n"
+            "   • Start a group voice chat\n"
+            "   • Use /play to start playing music\n\n"
+            "Once completed, you can enjoy music playback!"
+        )
+    
+    async def _get_assistant_id(self) -> int:
+        """Get the assistant user ID, resolving the username only once."""
+        if self._assistant_id is None:
+            async with self._resolve_lock:
+                if self._assistant_id is None:
+                    assistant_user = await self.bot.get_users(self.assistant_username)
+                    self._assistant_id = assistant_user.id
+        return self._assistant_id
+    
+    async def _get_assistant_member(self, chat_id: int) -> Optional[ChatMember]:
+        """Get the assistant's membership, or None if it is not a participant."""
+        try:
+            return await self.bot.get_chat_member(chat_id, self.assistant_username)
+        except UserNotParticipant:
+            return None
+    
+    async def _wait_for_assistant(self, chat_id: int) -> Optional[ChatMember]:
+        """Poll until the invited assistant shows up as a chat member."""
+        delay = JOIN_POLL_INITIAL_DELAY
+        remaining = JOIN_POLL_BUDGET
+        while remaining > 0:
+            step = min(delay, remaining)
+            await asyncio.sleep(step)
+            remaining -= step
+            member = await self._get_assistant_member(chat_id)
+            if member is not None and member.status not in ABSENT_STATUSES:
+                return member
+            delay *= 2
+        return None
     
     async def ensure_assistant_in_chat(self, chat_id: int) -> bool:
         """Ensure assistant is member of chat."""
@@ -33,27 +135,27 @@ class AssistantManager:
             # Get chat member info for assistant
             member = await self.bot.get_chat_member(chat_id, self.assistant_username)
             
-            if member.status == "left":
+            if member.status == ChatMemberStatus.LEFT:
                 # Assistant is not in chat, invite them
-                logger.info(f"Assistant not in chat {chat_id}, inviting...")
+                logger.info("Assistant not in chat %s, inviting...", chat_id)
                 return await self._invite_assistant(chat_id)
-            elif member.status == "kicked":
+            elif member.status == ChatMemberStatus.BANNED:
                 # Assistant was kicked, need to be re-invited
-                logger.info(f"Assistant was kicked from chat {chat_id}, re-inviting...")
+                logger.info("Assistant was kicked from chat %s, re-inviting...", chat_id)
                 return await self._invite_assistant(chat_id)
             else:
                 # Assistant is already in chat
-                logger.info(f"Assistant already in chat {chat_id}")
+                logger.info("Assistant already in chat %s", chat_id)
                 return True
                 
         except UserNotParticipant:
-            logger.info(f"Assistant not participant in chat {chat_id}, inviting...")
+            logger.info("Assistant not participant in chat %s, inviting...", chat_id)
             return await self._invite_assistant(chat_id)
         except ChatAdminRequired:
-            logger.error(f"Bot needs admin rights to invite assistant in chat {chat_id}")
+            logger.error("Bot needs admin rights to invite assistant in chat %s", chat_id)
             return False
         except Exception as e:
-            logger.error(f"Failed to check assistant status in chat {chat_id}: {e}")
+            logger.error("Failed to check assistant status in chat %s: %s", chat_id, e)
             return False
     
     async def _invite_assistant(self, chat_id: int) -> bool:
@@ -61,187 +163,142 @@ class AssistantManager:
         try:
             # Try to add assistant via bot
             await self.bot.add_chat_members(chat_id, [self.assistant_username])
-            logger.info(f"Assistant invited to chat {chat_id}")
+            logger.info("Assistant invited to chat %s", chat_id)
             return True
             
         except ChatAdminRequired:
-            logger.error(f"Bot needs admin rights to invite members in chat {chat_id}")
+            logger.error("Bot needs admin rights to invite members in chat %s", chat_id)
             return False
         except UserPrivacyRestricted:
-            logger.warning(f"Assistant has privacy restrictions in chat {chat_id}")
+            logger.warning("Assistant has privacy restrictions in chat %s", chat_id)
             # Try to get the assistant's invite link or send a join request
             return await self._handle_privacy_restriction(chat_id)
         except Exception as e:
-            logger.error(f"Failed to invite assistant to chat {chat_id}: {e}")
+            logger.error("Failed to invite assistant to chat %s: %s", chat_id, e)
             return False
     
     async def _handle_privacy_restriction(self, chat_id: int) -> bool:
         """Handle assistant privacy restrictions."""
         try:
-            # Try to get assistant's public username or link
-            assistant_user = await self.bot.get_users(self.assistant_username)
-            
             # Send message explaining situation
-            await self.bot.send_message(
-                chat_id,
-                f"🤖 The music assistant (@{self.assistant_username}) has privacy restrictions.\n\n"
-                "To use the music bot, please:\n"
-                "1. Add @{} to the chat manually, or\n"
-                "2. Ask the assistant to disable their privacy settings".format(self.assistant_username)
-            )
+            await self.bot.send_message(chat_id, self._privacy_message)
             
             return False
             
         except Exception as e:
-            logger.error(f"Failed to handle privacy restriction: {e}")
+            logger.error("Failed to handle privacy restriction: %s", e)
             return False
     
     async def promote_assistant(self, chat_id: int) -> bool:
         """Promote assistant with necessary privileges."""
         try:
             # Get assistant user ID
-            assistant_user = await self.bot.get_users(self.assistant_username)
-            assistant_id = assistant_user.id
-            
-            # Define required privileges
-            privileges = ChatPrivileges(
-                can_manage_video_chats=True,
-                can_manage_chat=True,
-                can_change_info=False,
-                can_delete_messages=False,
-                can_invite_users=False,
-                can_restrict_members=False,
-                can_pin_messages=False,
-                can_promote_members=False
-            )
+            assistant_id = await self._get_assistant_id()
             
             # Promote assistant
-            await self.bot.set_chat_member(
+            await self.bot.promote_chat_member(
                 chat_id,
                 assistant_id,
-                privileges
+                PROMOTE_PRIVILEGES
             )
             
-            logger.info(f"Promoted assistant in chat {chat_id}")
+            logger.info("Promoted assistant in chat %s", chat_id)
             return True
             
         except ChatAdminRequired:
-            logger.error(f"Bot needs admin rights to promote members in chat {chat_id}")
+            logger.error("Bot needs admin rights to promote members in chat %s", chat_id)
             return False
         except ChatAdminPrivilegesRequired:
-            logger.error(f"Bot needs admin privileges to promote members in chat {chat_id}")
+            logger.error("Bot needs admin privileges to promote members in chat %s", chat_id)
             return False
         except UserNotParticipant:
-            logger.error(f"Assistant is not in chat {chat_id}")
+            logger.error("Assistant is not in chat %s", chat_id)
             return False
         except Exception as e:
-            logger.error(f"Failed to promote assistant in chat {chat_id}: {e}")
+            logger.error("Failed to promote assistant in chat %s: %s", chat_id, e)
             return False
     
     async def demote_assistant(self, chat_id: int) -> bool:
         """Remove assistant privileges."""
         try:
-            assistant_user = await self.bot.get_users(self.assistant_username)
-            assistant_id = assistant_user.id
+            assistant_id = await self._get_assistant_id()
             
             # Remove all privileges
-            privileges = ChatPrivileges(
-                can_manage_video_chats=False,
-                can_manage_chat=False,
-                can_change_info=False,
-                can_delete_messages=False,
-                can_invite_users=False,
-                can_restrict_members=False,
-                can_pin_messages=False,
-                can_promote_members=False
-            )
-            
-            await self.bot.set_chat_member(
+            await self.bot.promote_chat_member(
                 chat_id,
                 assistant_id,
-                privileges
+                DEMOTE_PRIVILEGES
             )
             
-            logger.info(f"Demoted assistant in chat {chat_id}")
+            logger.info("Demoted assistant in chat %s", chat_id)
             return True
             
         except Exception as e:
-            logger.error(f"Failed to demote assistant in chat {chat_id}: {e}")
+            logger.error("Failed to demote assistant in chat %s: %s", chat_id, e)
             return False
     
     async def check_bot_admin_status(self, chat_id: int) -> bool:
         """Check if bot has admin rights in chat."""
         try:
             bot_member = await self.bot.get_chat_member(chat_id, "me")
-            return bot_member.status in ["administrator", "owner"]
+            return bot_member.status in ADMIN_STATUSES
         except Exception as e:
-            logger.error(f"Failed to check bot admin status in chat {chat_id}: {e}")
+            logger.error("Failed to check bot admin status in chat %s: %s", chat_id, e)
             return False
     
-    async def get_required_admin_rights(self) -> dict:
+    async def get_required_admin_rights(self) -> MappingProxyType:
         """Get list of required admin rights."""
-        return {
-            "can_manage_video_chats": True,
-            "can_manage_chat": True,
-            "can_change_info": False,
-            "can_delete_messages": False,
-            "can_invite_users": True,
-            "can_restrict_members": False,
-            "can_pin_messages": False,
-            "can_promote_members": False
-        }
+        return REQUIRED_ADMIN_RIGHTS
     
     async def setup_assistant_for_chat(self, chat_id: int) -> bool:
         """Complete setup: ensure assistant is member and promoted."""
         try:
             # Check bot admin status first
             if not await self.check_bot_admin_status(chat_id):
-                logger.error(f"Bot needs admin rights in chat {chat_id}")
+                logger.error("Bot needs admin rights in chat %s", chat_id)
                 return False
             
-            # Ensure assistant is in chat
-            if not await self.ensure_assistant_in_chat(chat_id):
-                logger.error(f"Failed to ensure assistant in chat {chat_id}")
-                return False
+            # One membership lookup decides whether to invite, promote or stop
+            member = await self._get_assistant_member(chat_id)
             
-            # Wait a bit for assistant to join
-            await asyncio.sleep(2)
+            if member is None or member.status in ABSENT_STATUSES:
+                logger.info("Assistant not in chat %s, inviting...", chat_id)
+                if not await self._invite_assistant(chat_id):
+                    logger.error("Failed to ensure assistant in chat %s", chat_id)
+                    return False
+                
+                # Wait for the assistant to join before promoting
+                member = await self._wait_for_assistant(chat_id)
+                if member is None:
+                    logger.warning("Assistant has not joined chat %s yet", chat_id)
+            
+            if (member is not None and member.status == ChatMemberStatus.ADMINISTRATOR
+                    and member.privileges and member.privileges.can_manage_video_chats):
+                logger.info("Assistant already promoted in chat %s", chat_id)
+                return True
             
             # Try to promote assistant
             if not await self.promote_assistant(chat_id):
-                logger.warning(f"Could not promote assistant in chat {chat_id}")
+                logger.warning("Could not promote assistant in chat %s", chat_id)
                 # Not a critical error, assistant might work without promotion
             
             return True
             
+        except ChatAdminRequired:
+            logger.error("Bot needs admin rights to invite assistant in chat %s", chat_id)
+            return False
         except Exception as e:
-            logger.error(f"Failed to setup assistant for chat {chat_id}: {e}")
+            logger.error("Failed to setup assistant for chat %s: %s", chat_id, e)
             return False
     
     async def send_setup_instructions(self, chat_id: int) -> bool:
         """Send setup instructions to chat."""
         try:
-            instructions = (
-                "🤖 **Music Bot Setup Instructions**\n\n"
-                "To use the music bot, I need the following:\n\n"
-                "1️⃣ **Admin Rights for Bot:**\n"
-                "   • Make the bot an administrator\n"
-                "   • Grant 'Manage Video Chats' permission\n"
-                "   • Allow adding members\n\n"
-                "2️⃣ **Add Music Assistant:**\n"
-                f"   • Add @{self.assistant_username} to the chat\n"
-                "   • Grant 'Manage Video Chats' permission\n\n"
-                "3️⃣ **Start Voice Chat:**\n"
-                "   • Start a group voice chat\n"
-                "   • Use /play to start playing music\n\n"
-                "Once completed, you can enjoy music playback!"
-            )
-            
-            await self.bot.send_message(chat_id, instructions)
+            await self.bot.send_message(chat_id, self._setup_instructions)
             return True
             
         except Exception as e:
-            logger.error(f"Failed to send setup instructions to chat {chat_id}: {e}")
+            logger.error("Failed to send setup instructions to chat %s: %s", chat_id, e)
             return False
     
     async def cleanup_assistant_from_chat(self, chat_id: int) -> bool:
@@ -251,9 +308,9 @@ class AssistantManager:
             # But we might want to keep them for future use
             
             # For now, just log
-            logger.info(f"Cleaning up assistant from chat {chat_id}")
+            logger.info("Cleaning up assistant from chat %s", chat_id)
             return True
             
         except Exception as e:
-            logger.error(f"Failed to cleanup assistant from chat {chat_id}: {e}")
+            logger.error("Failed to cleanup assistant from chat %s: %s", chat_id, e)
             return False
@@ -1,12 +1,18 @@
 """
 Text formatting helpers for music bot.
 """
-import re
 from typing import Optional, Dict, Any
 from datetime import timedelta
 
 from bot.helpers.localization import Localization
 
+# Characters stripped from user-facing text (HTML-sensitive)
+_HTML_CHARS_TABLE = str.maketrans('', '', '<>"\'')
+# Markdown special characters, each prefixed with a backslash
+_MARKDOWN_ESCAPE_TABLE = str.maketrans({c: f'\\{c}' for c in '*_[]()~`>#+-=|{}.!'})
+# File size units, one per power of 1024
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB')
+
 
 class Formatter:
     """Text formatting utilities."""
@@ -59,7 +65,7 @@ class Formatter:
         """Format queue header."""
         total_tracks = queue_info.get('total_tracks', 0)
         current_track = queue_info.get('current_track')
-        current_title = Formatter.sanitize_text(current_track.get('title', 'None')) if current_track else 'None'
+        current_title = Formatter.sanitize_text(current_track.title) if current_track else 'None'
         
         total_duration = queue_info.get('total_duration', 0)
         formatted_duration = Formatter.format_duration(total_duration, localization, chat_id)
@@ -118,10 +124,8 @@ class Formatter:
         if not text:
             return "Unknown"
         
-        # Remove or replace problematic characters
-        text = re.sub(r'[<>"\']', '', text)  # Remove HTML chars
-        text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
-        text = text.strip()
+        # Remove HTML chars, then collapse and strip whitespace in one pass
+        text = " ".join(text.translate(_HTML_CHARS_TABLE).split())
         
         # Truncate if needed
         if max_length and len(text) > max_length:
@@ -146,14 +150,12 @@ class Formatter:
     @staticmethod
     def format_file_size(size_bytes: int) -> str:
         """Format file size in human readable format."""
-        if size_bytes < 1024:
+        # Each unit covers 10 more bits of the size
+        index = min(max((size_bytes.bit_length() - 1) // 10, 0), len(_SIZE_UNITS) - 1)
+        if index == 0:
             return f"{size_bytes} B"
-        elif size_bytes < 1024 * 1024:
-            return f"{size_bytes / 1024:.1f} KB"
-        elif size_bytes < 1024 * 1024 * 1024:
-            return f"{size_bytes / (1024 * 1024):.1f} MB"
-        else:
-            return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+        
+        return f"{size_bytes / (1 << (10 * index)):.1f} {_SIZE_UNITS[index]}"
     
     @staticmethod
     def format_search_results(results: list, localization: Localization, chat_id: int) -> str:
@@ -161,10 +163,13 @@ class Formatter:
         if not results:
             return "No results found."
         
+        # Resolve the chat's language once for all results
+        format_duration = localization.get_duration_formatter(chat_id)
+        
         formatted = []
         for i, result in enumerate(results[:10], 1):  # Limit to 10 results
             title = Formatter.sanitize_text(result.get('title', 'Unknown'), 50)
-            duration = Formatter.format_duration(result.get('duration', 0), localization, chat_id)
+            duration = format_duration(result.get('duration') or 0)
             uploader = Formatter.sanitize_text(result.get('uploader', 'Unknown'), 30)
             
             formatted.append(f"{i}. **{title}**\n   👤 {uploader} • ⏱️ {duration}")
@@ -204,7 +209,4 @@ class Formatter:
     @staticmethod
     def escape_markdown(text: str) -> str:
         """Escape markdown special characters."""
-        special_chars = ['*', '_', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-        for char in special_chars:
-            text = text.replace(char, f'\\{char}')
-        return text
+        return text.translate(_MARKDOWN_ESCAPE_TABLE)
@@ -0,0 +1,24 @@
+"""
+JSON encoding helpers, using orjson when it is installed.
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(value: Any) -> str:
+    """Serialize a value to JSON text, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(value)
+
+
+def json_loads(text: Union[bytes, str]) -> Any:
+    """Parse JSON text, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
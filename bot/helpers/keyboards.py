@@ -1,26 +1,45 @@
 """
 Inline keyboard builders for bot interface.
 """
-from typing import List, Dict, Any, Optional
+import functools
+import re
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping, Optional, Sequence
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from bot.core.queue import Track, QUEUE_PAGE_SIZE
+
+# Names of the positional parameters following the callback action
+_CALLBACK_PARAMS = ("chat_id", "page", "index")
+
+# Up to 64 alphanumeric, underscore, colon or hyphen characters
+_CALLBACK_DATA_RE = re.compile(r'[A-Za-z0-9_:-]{0,64}')
+
+
+def _to_int(value: str):
+    """Convert a callback parameter to int when it is numeric."""
+    # Strip a single sign only; "--5" must stay a string
+    digits = value[1:] if value.startswith("-") else value
+    return int(value) if digits.isdecimal() else value
+
 
 class KeyboardBuilder:
     """Builder for inline keyboards."""
     
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def build_playback_controls(chat_id: int, is_playing: bool, localization) -> InlineKeyboardMarkup:
-        """Build playback control keyboard."""
+        """Build playback control keyboard (cached; labels are always English)."""
         buttons = []
         
         # Pause/Resume button
         if is_playing:
-            pause_text = localization.get_text_by_lang(
+            pause_text = localization.get_flat(
                 "en", "playback_controls.pause"
             )  # Use English for button text consistency
             callback_data = f"player_pause:{chat_id}"
         else:
-            pause_text = localization.get_text_by_lang(
+            pause_text = localization.get_flat(
                 "en", "playback_controls.resume"
             )
             callback_data = f"player_play:{chat_id}"
@@ -28,10 +47,10 @@ class KeyboardBuilder:
         buttons.append([InlineKeyboardButton(pause_text, callback_data=callback_data)])
         
         # Other control buttons
-        skip_text = localization.get_text_by_lang("en", "playback_controls.skip")
-        stop_text = localization.get_text_by_lang("en", "playback_controls.stop")
-        queue_text = localization.get_text_by_lang("en", "playback_controls.queue")
-        settings_text = localization.get_text_by_lang("en", "playback_controls.settings")
+        skip_text = localization.get_flat("en", "playback_controls.skip")
+        stop_text = localization.get_flat("en", "playback_controls.stop")
+        queue_text = localization.get_flat("en", "playback_controls.queue")
+        settings_text = localization.get_flat("en", "playback_controls.settings")
         
         buttons.append([
             InlineKeyboardButton(skip_text, callback_data=f"player_skip:{chat_id}"),
@@ -46,26 +65,27 @@ class KeyboardBuilder:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def build_queue_navigation(
         chat_id: int, 
         page: int, 
         total_pages: int, 
         localization
     ) -> InlineKeyboardMarkup:
-        """Build queue navigation keyboard."""
+        """Build queue navigation keyboard (cached; labels are always English)."""
         buttons = []
         
         # Navigation buttons
         nav_buttons = []
         
         if page > 0:
-            prev_text = localization.get_text_by_lang("en", "queue_controls.previous")
+            prev_text = localization.get_flat("en", "queue_controls.previous")
             nav_buttons.append(
                 InlineKeyboardButton(prev_text, callback_data=f"queue_nav:{chat_id}:{page-1}")
             )
         
         if page < total_pages - 1:
-            next_text = localization.get_text_by_lang("en", "queue_controls.next")
+            next_text = localization.get_flat("en", "queue_controls.next")
             nav_buttons.append(
                 InlineKeyboardButton(next_text, callback_data=f"queue_nav:{chat_id}:{page+1}")
             )
@@ -76,11 +96,11 @@ class KeyboardBuilder:
         # Refresh and back buttons
         buttons.append([
             InlineKeyboardButton(
-                localization.get_text_by_lang("en", "queue_controls.refresh"),
+                localization.get_flat("en", "queue_controls.refresh"),
                 callback_data=f"queue_open:{chat_id}:{page}"
             ),
             InlineKeyboardButton(
-                localization.get_text_by_lang("en", "queue_controls.back_to_player"),
+                localization.get_flat("en", "queue_controls.back_to_player"),
                 callback_data=f"player_back:{chat_id}"
             ),
         ])
@@ -88,13 +108,14 @@ class KeyboardBuilder:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def build_settings_menu(chat_id: int, localization) -> InlineKeyboardMarkup:
-        """Build settings menu keyboard."""
+        """Build settings menu keyboard (cached; labels are always English)."""
         buttons = []
         
         # Volume controls
-        volume_up_text = localization.get_text_by_lang("en", "settings_controls.volume_up")
-        volume_down_text = localization.get_text_by_lang("en", "settings_controls.volume_down")
+        volume_up_text = localization.get_flat("en", "settings_controls.volume_up")
+        volume_down_text = localization.get_flat("en", "settings_controls.volume_down")
         
         buttons.append([
             InlineKeyboardButton(volume_up_text, callback_data=f"volume_up:{chat_id}"),
@@ -102,8 +123,8 @@ class KeyboardBuilder:
         ])
         
         # Loop and shuffle
-        loop_text = localization.get_text_by_lang("en", "settings_controls.loop_track")
-        shuffle_text = localization.get_text_by_lang("en", "settings_controls.shuffle")
+        loop_text = localization.get_flat("en", "settings_controls.loop_track")
+        shuffle_text = localization.get_flat("en", "settings_controls.shuffle")
         
         buttons.append([
             InlineKeyboardButton(loop_text, callback_data=f"loop_toggle:{chat_id}"),
@@ -113,7 +134,7 @@ class KeyboardBuilder:
         # Back button
         buttons.append([
             InlineKeyboardButton(
-                localization.get_text_by_lang("en", "settings_controls.back_to_player"),
+                localization.get_flat("en", "settings_controls.back_to_player"),
                 callback_data=f"player_back:{chat_id}"
             )
         ])
@@ -121,8 +142,9 @@ class KeyboardBuilder:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @functools.lru_cache(maxsize=16)
     def build_language_selection(current_lang: str, localization) -> InlineKeyboardMarkup:
-        """Build language selection keyboard."""
+        """Build language selection keyboard (cached; the language list is fixed)."""
         buttons = []
         
         langs = localization.get_available_languages()
@@ -141,28 +163,23 @@ class KeyboardBuilder:
     @staticmethod
     def build_track_queue_items(
         chat_id: int,
-        tracks: List[Dict[str, Any]],
+        tracks: Sequence[Track],
         current_index: int,
         page: int,
         localization
     ) -> List[List[InlineKeyboardButton]]:
         """Build queue track list buttons."""
-        buttons = []
-        
-        for i, track in enumerate(tracks):
-            global_index = page * 10 + i  # Assuming 10 tracks per page
-            
-            if global_index == current_index:
-                # Current playing track
-                text = f"▶️ {track['title'][:30]}..."
-            else:
-                text = f"{global_index + 1}. {track['title'][:30]}..."
-            
-            # Add callback to skip to this track
-            callback_data = f"queue_skip:{chat_id}:{global_index}"
-            buttons.append([InlineKeyboardButton(text, callback_data=callback_data)])
+        offset = page * QUEUE_PAGE_SIZE
         
-        return buttons
+        # Current track is marked, the rest are numbered; each skips to its track
+        return [
+            [InlineKeyboardButton(
+                f"▶️ {track.title[:30]}..." if index == current_index
+                else f"{index + 1}. {track.title[:30]}...",
+                callback_data=f"queue_skip:{chat_id}:{page}:{index}"
+            )]
+            for index, track in enumerate(tracks, offset)
+        ]
     
     @staticmethod
     def build_confirmation_keyboard(chat_id: int, action: str, localization) -> InlineKeyboardMarkup:
@@ -180,11 +197,12 @@ class KeyboardBuilder:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def build_simple_back_button(chat_id: int, localization) -> InlineKeyboardMarkup:
-        """Build simple back button."""
+        """Build simple back button (cached; labels are always English)."""
         buttons = [
             [InlineKeyboardButton(
-                localization.get_text_by_lang("en", "queue_controls.back_to_player"),
+                localization.get_flat("en", "queue_controls.back_to_player"),
                 callback_data=f"player_back:{chat_id}"
             )]
         ]
@@ -192,45 +210,32 @@ class KeyboardBuilder:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
-    def parse_callback_data(callback_data: str) -> Dict[str, Any]:
-        """Parse callback data to extract action and parameters."""
-        parts = callback_data.split(":")
-        
-        if len(parts) < 1:
-            return {"action": "unknown"}
-        
-        action = parts[0]
-        params = parts[1:] if len(parts) > 1 else []
-        
-        result = {"action": action, "params": params}
-        
-        # Parse common parameters
-        if len(params) >= 1:
-            try:
-                result["chat_id"] = int(params[0])
-            except ValueError:
-                result["chat_id"] = params[0]
-        
-        if len(params) >= 2:
-            try:
-                result["page"] = int(params[1])
-            except ValueError:
-                result["page"] = params[1]
-        
-        if len(params) >= 3:
-            try:
-                result["index"] = int(params[2])
-            except ValueError:
-                result["index"] = params[2]
-        
-        return result
+    def clear_label_caches():
+        """Drop cached keyboards, whose labels come from the loaded translations."""
+        for builder in (
+            KeyboardBuilder.build_playback_controls,
+            KeyboardBuilder.build_queue_navigation,
+            KeyboardBuilder.build_settings_menu,
+            KeyboardBuilder.build_language_selection,
+            KeyboardBuilder.build_simple_back_button,
+        ):
+            builder.cache_clear()
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def parse_callback_data(callback_data: str) -> Mapping[str, Any]:
+        """Parse callback data to extract action and parameters (read-only, cached)."""
+        action, *params = callback_data.split(":")
+        
+        result = {"action": action, "params": tuple(params)}
+        
+        # Parse common parameters by position
+        for name, value in zip(_CALLBACK_PARAMS, params):
+            result[name] = _to_int(value)
+        
+        return MappingProxyType(result)
     
     @staticmethod
     def validate_callback_data(callback_data: str) -> bool:
         """Validate callback data format."""
-        if len(callback_data) > 64:
-            return False
-        
-        # Basic validation - alphanumeric, underscore, colon, hyphen only
-        allowed_chars = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_:-')
-        return all(c in allowed_chars for c in callback_data)
+        return _CALLBACK_DATA_RE.fullmatch(callback_data) is not None
@@ -1,10 +1,14 @@
 """
 Internationalization (i18n) module for multi-language support.
 """
-import json
+import functools
 import logging
+import sys
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Optional, Tuple
+
+from bot.helpers.jsonutil import json_loads
+from bot.helpers.keyboards import KeyboardBuilder
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +22,16 @@ class Localization:
         self.translations: Dict[str, Dict[str, Any]] = {}
         self.user_languages: Dict[int, str] = {}
         self.default_language = "en"
+        # Leaf translations keyed by dotted path, per language
+        self._flat: Dict[str, Dict[str, Any]] = {}
+        # (filled, empty, length) progress bar settings per language
+        self._progress_cfg: Dict[str, Tuple[str, str, int]] = {}
+        
+        # Cache of resolved (lang, key) -> raw template lookups
+        self._lookup = functools.lru_cache(maxsize=4096)(self._resolve_text)
+        # Caches of rendered durations and progress bars per language
+        self._duration_cache = functools.lru_cache(maxsize=4096)(self._render_duration)
+        self._progress_bar_cache = functools.lru_cache(maxsize=1024)(self._render_progress_bar)
         
         # Load all translations
         self._load_translations()
@@ -28,8 +42,8 @@ class Localization:
             for locale_file in self.locales_dir.glob("*.json"):
                 locale_name = locale_file.stem
                 
-                with open(locale_file, 'r', encoding='utf-8') as f:
-                    self.translations[locale_name] = json.load(f)
+                # Parsed from bytes so orjson can skip the text decode
+                self.translations[locale_name] = json_loads(locale_file.read_bytes())
                 
                 logger.info(f"Loaded translation for {locale_name}")
             
@@ -39,6 +53,44 @@ class Localization:
             logger.error(f"Failed to load translations: {e}")
             # Fallback to empty dict
             self.translations = {self.default_language: {}}
+        
+        self._flat = {
+            lang: self._flatten(tree) for lang, tree in self.translations.items()
+        }
+        self._progress_cfg = {}
+        for lang, tree in self.translations.items():
+            bar_config = tree.get("progress_bar", {})
+            self._progress_cfg[lang] = (
+                bar_config.get("filled", "●"),
+                bar_config.get("empty", "○"),
+                bar_config.get("length", 20)
+            )
+        
+        # Drop anything resolved from previously loaded translations
+        self._lookup.cache_clear()
+        self._duration_cache.cache_clear()
+        self._progress_bar_cache.cache_clear()
+        KeyboardBuilder.clear_label_caches()
+    
+    @staticmethod
+    def _flatten(tree: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+        """Flatten nested translations into dotted keys."""
+        flat = {}
+        for name, value in tree.items():
+            key = sys.intern(f"{prefix}{name}")
+            if isinstance(value, dict):
+                flat.update(Localization._flatten(value, f"{key}."))
+            else:
+                flat[key] = value
+        return flat
+    
+    def get_flat(self, lang: str, key: str) -> str:
+        """Get an unformatted translation by dotted key."""
+        text = self._flat.get(lang, {}).get(key)
+        if text is None:
+            # Fall back to the default language and missing-key handling
+            return self._lookup(lang, key)
+        return text
     
     def get_text(self, chat_id: int, key: str, **kwargs) -> str:
         """Get translated text for user/chat."""
@@ -47,18 +99,7 @@ class Localization:
     
     def get_text_by_lang(self, lang: str, key: str, **kwargs) -> str:
         """Get translated text by language."""
-        # Try requested language
-        if lang in self.translations and key in self.translations[lang]:
-            text = self.translations[lang][key]
-        else:
-            # Fallback to default language
-            if self.default_language in self.translations and key in self.translations[self.default_language]:
-                text = self.translations[self.default_language][key]
-                logger.warning(f"Falling back to default language for key: {key}")
-            else:
-                # Final fallback
-                text = f"[MISSING_TRANSLATION: {key}]"
-                logger.error(f"Missing translation for key: {key}")
+        text = self._lookup(lang, key)
         
         # Format with kwargs
         if kwargs:
@@ -70,6 +111,37 @@ class Localization:
         
         return text
     
+    def _resolve_text(self, lang: str, key: str) -> Any:
+        """Resolve the raw translation for a language and dotted key."""
+        # Try requested language
+        text = self._find_text(lang, key)
+        if text is None:
+            # Fallback to default language
+            text = self._find_text(self.default_language, key)
+            if text is not None:
+                logger.warning(f"Falling back to default language for key: {key}")
+            else:
+                # Final fallback
+                text = f"[MISSING_TRANSLATION: {key}]"
+                logger.error(f"Missing translation for key: {key}")
+        
+        return text
+    
+    def _find_text(self, lang: str, key: str) -> Optional[Any]:
+        """Walk a dotted key through the nested translations of a language."""
+        # Leaf strings come straight from the flattened table
+        text = self._flat.get(lang, {}).get(key)
+        if text is not None:
+            return text
+        
+        # Sections (e.g. "progress_bar") still need the nested walk
+        node = self.translations.get(lang)
+        for part in key.split("."):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+    
     def set_user_language(self, chat_id: int, lang: str):
         """Set user language preference."""
         if lang in self.translations:
@@ -91,36 +163,47 @@ class Localization:
     
     def format_duration(self, seconds: int, chat_id: int) -> str:
         """Format duration in human readable format."""
+        return self._duration_cache(seconds, self.get_user_language(chat_id))
+    
+    def get_duration_formatter(self, chat_id: int) -> Callable[[int], str]:
+        """Get a duration formatter bound to the chat's language."""
+        lang = self.get_user_language(chat_id)
+        
+        def format_duration(seconds: int) -> str:
+            return self._duration_cache(seconds, lang)
+        
+        return format_duration
+    
+    def _render_duration(self, seconds: int, lang: str) -> str:
+        """Render a duration for a language."""
         if seconds <= 0:
-            return self.get_text(chat_id, "time_formats.unknown")
+            return self.get_text_by_lang(lang, "time_formats.unknown")
         
         hours = seconds // 3600
         minutes = (seconds % 3600) // 60
         secs = seconds % 60
         
         if hours > 0:
-            return self.get_text(chat_id, "time_formats.long",
-                               hours=hours, minutes=minutes, seconds=secs)
+            return self.get_text_by_lang(lang, "time_formats.long",
+                                         hours=hours, minutes=minutes, seconds=secs)
         else:
-            return self.get_text(chat_id, "time_formats.short",
-                               minutes=minutes, seconds=secs)
+            return self.get_text_by_lang(lang, "time_formats.short",
+                                         minutes=minutes, seconds=secs)
     
     def format_progress_bar(self, current: int, total: int, chat_id: int) -> str:
         """Format progress bar."""
         if total <= 0:
             return ""
         
-        progress = int((current / total) * 20)  # 20 characters max
-        
-        config = self.translations.get(
-            self.user_languages.get(chat_id, self.default_language), {}
-        ).get("progress_bar", {})
-        
-        filled = config.get("filled", "●")
-        empty = config.get("empty", "○")
-        length = config.get("length", 20)
+        # The bar only changes with the integer percentage
+        percentage = int((current / total) * 100)
+        return self._progress_bar_cache(percentage, self.get_user_language(chat_id))
+    
+    def _render_progress_bar(self, percentage: int, lang: str) -> str:
+        """Render a progress bar for a percentage and language."""
+        filled, empty, length = self._progress_cfg.get(lang, ("●", "○", 20))
+        progress = min(percentage, 100) * length // 100
         
         bar = filled * progress + empty * (length - progress)
-        percentage = int((current / total) * 100)
         
         return f"{bar} {percentage}%"
@@ -3,23 +3,60 @@ YouTube helper for yt-dlp integration and music search/download.
 """
 import asyncio
 import logging
-import tempfile
+import os
 import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Dict, Any, List
-from urllib.parse import urlparse
 
 import yt_dlp
 
 logger = logging.getLogger(__name__)
 
+# Hosts recognised as YouTube
+_YOUTUBE_DOMAINS = frozenset({
+    'youtube.com',
+    'www.youtube.com',
+    'm.youtube.com',
+    'youtu.be',
+    'www.youtu.be'
+})
+# URL prefixes for those hosts, checked with a single str.startswith
+_YOUTUBE_PREFIXES = tuple(
+    f"{scheme}://{domain}/"
+    for scheme in ('https', 'http')
+    for domain in sorted(_YOUTUBE_DOMAINS)
+)
+# Number of downloaded tracks remembered by video ID
+INFO_CACHE_SIZE = 256
+
+# Seconds that persisted download metadata stays valid; no longer than the
+# 24 hours downloaded files are kept, after which the rows only point at nothing
+METADATA_TTL = 24 * 3600
+
+# Worker threads running blocking yt-dlp extractions
+EXTRACT_WORKERS = 4
+# Downloads one chat may run at once, leaving workers free for other chats
+DOWNLOADS_PER_CHAT = 1
+
+# Patterns capturing the 11-character video ID, tried in order
+_VIDEO_ID_PATTERNS = (
+    re.compile(r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/)([a-zA-Z0-9_-]{11})'),
+    re.compile(r'youtube\.com/v/([a-zA-Z0-9_-]{11})'),
+)
+
 
 class YouTubeHelper:
     """YouTube search and download helper."""
     
-    def __init__(self, download_dir: Path):
+    def __init__(self, download_dir: Path, storage=None):
         """Initialize YouTube helper."""
         self.download_dir = download_dir
+        self.storage = storage
         self.download_dir.mkdir(parents=True, exist_ok=True)
         
         # yt-dlp options
@@ -42,32 +79,57 @@ class YouTubeHelper:
             'writethumbnail': False,
             'writeskiplist': False,
         }
+        
+        # Downloads are named by video ID so the downloaded path is known up front
+        self._download_opts = {
+            **self.ydl_opts,
+            'outtmpl': str(self.download_dir / '%(id)s.%(ext)s')
+        }
+        
+        # Track info of recent downloads by video ID, least recent first
+        self._info_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        
+        # yt-dlp is blocking; run it off the event loop with bounded concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            thread_name_prefix="yt-dlp"
+        )
+        # YoutubeDL instances are not thread-safe, so each worker keeps its own
+        self._ydl_local = threading.local()
+        # Per-chat download semaphores; an idle one is dropped with its last waiter
+        self._chat_downloads: "weakref.WeakValueDictionary[int, asyncio.Semaphore]" = (
+            weakref.WeakValueDictionary()
+        )
+    
+    def _extract_info_sync(self, opts: Dict[str, Any], url: str, download: bool) -> Optional[Dict[str, Any]]:
+        """Run a yt-dlp extraction (called in a worker thread)."""
+        # Reuse this worker's YoutubeDL for the option set; opts dicts live as
+        # long as the helper, so their identity is a stable key
+        instances = getattr(self._ydl_local, 'instances', None)
+        if instances is None:
+            instances = self._ydl_local.instances = {}
+        
+        ydl = instances.get(id(opts))
+        if ydl is None:
+            ydl = instances[id(opts)] = yt_dlp.YoutubeDL(opts)
+        
+        return ydl.extract_info(url, download=download)
+    
+    async def _extract_info(self, opts: Dict[str, Any], url: str, download: bool) -> Optional[Dict[str, Any]]:
+        """Run a yt-dlp extraction on the worker pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._extract_info_sync, opts, url, download
+        )
     
     def is_youtube_url(self, url: str) -> bool:
         """Check if URL is a YouTube URL."""
-        youtube_domains = [
-            'youtube.com',
-            'www.youtube.com',
-            'm.youtube.com',
-            'youtu.be',
-            'www.youtu.be'
-        ]
-        
-        try:
-            parsed = urlparse(url)
-            return parsed.netloc in youtube_domains
-        except:
-            return False
+        return url.startswith(_YOUTUBE_PREFIXES)
     
     def extract_video_id(self, url: str) -> Optional[str]:
         """Extract video ID from YouTube URL."""
-        patterns = [
-            r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/)([a-zA-Z0-9_-]{11})',
-            r'youtube\.com/v/([a-zA-Z0-9_-]{11})',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
+        for pattern in _VIDEO_ID_PATTERNS:
+            match = pattern.search(url)
             if match:
                 return match.group(1)
         
@@ -76,32 +138,27 @@ class YouTubeHelper:
     async def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Search for videos on YouTube."""
         try:
-            search_opts = self.ydl_opts.copy()
-            search_opts['format'] = 'bestaudio/best'
-            search_opts['noplaylist'] = True
-            
-            with yt_dlp.YoutubeDL(search_opts) as ydl:
-                # Search for videos
-                search_query = f"ytsearch{limit}:{query}"
-                results = ydl.extract_info(search_query, download=False)
-                
-                videos = []
-                if 'entries' in results:
-                    for entry in results['entries']:
-                        if entry:
-                            videos.append({
-                                'id': entry.get('id'),
-                                'title': entry.get('title', 'Unknown'),
-                                'duration': entry.get('duration', 0),
-                                'uploader': entry.get('uploader', 'Unknown'),
-                                'thumbnail': entry.get('thumbnail'),
-                                'webpage_url': entry.get('webpage_url'),
-                                'view_count': entry.get('view_count', 0),
-                            })
-                
-                logger.info(f"Found {len(videos)} videos for query: {query}")
-                return videos
-                
+            # Search for videos
+            search_query = f"ytsearch{limit}:{query}"
+            results = await self._extract_info(self.ydl_opts, search_query, False)
+            
+            videos = []
+            if 'entries' in results:
+                for entry in results['entries']:
+                    if entry:
+                        videos.append({
+                            'id': entry.get('id'),
+                            'title': entry.get('title', 'Unknown'),
+                            'duration': entry.get('duration', 0),
+                            'uploader': entry.get('uploader', 'Unknown'),
+                            'thumbnail': entry.get('thumbnail'),
+                            'webpage_url': entry.get('webpage_url'),
+                            'view_count': entry.get('view_count', 0),
+                        })
+            
+            logger.info(f"Found {len(videos)} videos for query: {query}")
+            return videos
+            
         except Exception as e:
             logger.error(f"Search failed for query '{query}': {e}")
             return []
@@ -109,132 +166,180 @@ class YouTubeHelper:
     async def get_video_info(self, url: str) -> Optional[Dict[str, Any]]:
         """Get video information without downloading."""
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if not info:
-                    return None
-                
-                return {
-                    'id': info.get('id'),
-                    'title': info.get('title', 'Unknown'),
-                    'duration': info.get('duration', 0),
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'thumbnail': info.get('thumbnail'),
-                    'webpage_url': info.get('webpage_url'),
-                    'view_count': info.get('view_count', 0),
-                    'description': info.get('description', ''),
-                }
-                
+            info = await self._extract_info(self.ydl_opts, url, False)
+            
+            if not info:
+                return None
+            
+            return {
+                'id': info.get('id'),
+                'title': info.get('title', 'Unknown'),
+                'duration': info.get('duration', 0),
+                'uploader': info.get('uploader', 'Unknown'),
+                'thumbnail': info.get('thumbnail'),
+                'webpage_url': info.get('webpage_url'),
+                'view_count': info.get('view_count', 0),
+                'description': info.get('description', ''),
+            }
+            
         except Exception as e:
             logger.error(f"Failed to get video info for {url}: {e}")
             return None
     
     async def download_audio(self, url: str) -> Optional[Dict[str, Any]]:
-        """Download audio from URL."""
+        """Download audio from URL (or the top hit of a ytsearch1: query)."""
         try:
-            # Create a temporary file for download
-            with tempfile.NamedTemporaryFile(
-                suffix='.mp3', 
-                dir=self.download_dir, 
-                delete=False
-            ) as temp_file:
-                temp_path = Path(temp_file.name)
-            
-            download_opts = self.ydl_opts.copy()
-            download_opts['outtmpl'] = str(temp_path.with_suffix('.%(ext)s'))
+            # Replay a known download if its file is still on disk
+            video_id = self.extract_video_id(url)
+            cached = await self._get_cached_info(video_id) if video_id else None
+            if cached:
+                logger.info(f"Using cached download: {cached['title']}")
+                return dict(cached)
             
             logger.info(f"Starting download: {url}")
             
-            with yt_dlp.YoutubeDL(download_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                
-                if not info:
-                    return None
-                
-                # Find the downloaded file
-                downloaded_files = list(self.download_dir.glob(f"*{info.get('id', '')}*"))
-                if not downloaded_files:
-                    downloaded_files = list(self.download_dir.glob("*.mp3"))
-                    # Sort by modification time and get the most recent
-                    downloaded_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-                    if downloaded_files:
-                        temp_path = downloaded_files[0]
-                
-                # Get the actual file path
-                if temp_path.exists():
-                    file_path = temp_path
-                else:
-                    # Try to find by ID
-                    id_pattern = f"*{info.get('id', '')}*"
-                    matching_files = list(self.download_dir.glob(id_pattern))
-                    if matching_files:
-                        file_path = matching_files[0]
-                    else:
-                        logger.error("Downloaded file not found")
-                        return None
-                
-                track_info = {
-                    'file_path': str(file_path),
-                    'title': info.get('title', 'Unknown'),
-                    'artist': info.get('uploader', 'Unknown'),
-                    'duration': info.get('duration', 0),
-                    'thumbnail': info.get('thumbnail'),
-                    'source_url': url,
-                    'video_id': info.get('id'),
-                    'view_count': info.get('view_count', 0),
-                    'description': info.get('description', '')
-                }
-                
-                logger.info(f"Successfully downloaded: {track_info['title']}")
-                return track_info
-                
+            info = await self._extract_info(self._download_opts, url, True)
+            
+            # Search queries resolve to a playlist holding the single hit
+            if info and 'entries' in info:
+                entries = info['entries']
+                info = entries[0] if entries else None
+            
+            if not info:
+                return None
+            
+            # yt-dlp reports where each requested download ended up
+            requested = info.get('requested_downloads')
+            if requested:
+                file_path = Path(requested[0]['filepath'])
+            else:
+                file_path = self.download_dir / f"{info['id']}.{info['ext']}"
+            
+            if not file_path.exists():
+                logger.error("Downloaded file not found")
+                return None
+            
+            track_info = {
+                'file_path': str(file_path),
+                'title': info.get('title', 'Unknown'),
+                'artist': info.get('uploader', 'Unknown'),
+                'duration': info.get('duration', 0),
+                'thumbnail': info.get('thumbnail'),
+                'source_url': info.get('webpage_url') or url,
+                'video_id': info.get('id'),
+                'view_count': info.get('view_count', 0),
+                'description': info.get('description', '')
+            }
+            
+            if track_info['video_id']:
+                self._remember_info(track_info)
+                if self.storage:
+                    await self.storage.set(
+                        f"yt_info:{track_info['video_id']}",
+                        {"info": track_info, "cached_at": time.time()}
+                    )
+            
+            logger.info(f"Successfully downloaded: {track_info['title']}")
+            return dict(track_info)
+            
         except Exception as e:
             logger.error(f"Download failed for {url}: {e}")
-            # Clean up temp file if it exists
-            if temp_path.exists():
-                try:
-                    temp_path.unlink()
-                except:
-                    pass
             return None
     
-    async def handle_url(self, url_or_query: str) -> Optional[Dict[str, Any]]:
-        """Handle URL or search query."""
+    def _remember_info(self, track_info: Dict[str, Any]):
+        """Add track info to the in-memory LRU."""
+        video_id = track_info['video_id']
+        self._info_cache[video_id] = track_info
+        self._info_cache.move_to_end(video_id)
+        if len(self._info_cache) > INFO_CACHE_SIZE:
+            self._info_cache.popitem(last=False)
+    
+    async def _get_cached_info(self, video_id: str) -> Optional[Dict[str, Any]]:
+        """Get known track info whose file still exists, from memory or storage."""
+        cached = self._info_cache.get(video_id)
+        if cached:
+            if Path(cached['file_path']).exists():
+                self._info_cache.move_to_end(video_id)
+                return cached
+            del self._info_cache[video_id]
+        
+        # Survives restarts; rows that expired or lost their file are dropped
+        if self.storage:
+            key = f"yt_info:{video_id}"
+            stored = await self.storage.get(key)
+            if stored:
+                if self._is_live(stored):
+                    self._remember_info(stored["info"])
+                    return stored["info"]
+                await self.storage.delete(key)
+        
+        return None
+    
+    @staticmethod
+    def _is_live(stored: Dict[str, Any]) -> bool:
+        """Check that a stored metadata row is within its TTL and its file exists."""
+        return (time.time() - stored["cached_at"] < METADATA_TTL
+                and Path(stored["info"]["file_path"]).exists())
+    
+    async def prune_metadata(self) -> int:
+        """Delete persisted metadata rows that expired or whose file is gone."""
+        if not self.storage:
+            return 0
+        
+        try:
+            removed = await self.storage.delete_older_than("yt_info:*", METADATA_TTL)
+            if removed is None:
+                # Backend can't filter by age; check each row instead
+                stored = await self.storage.get_pattern("yt_info:*")
+                stale = [key for key, value in stored.items() if not self._is_live(value)]
+                removed = await self.storage.delete_many(stale) if stale else 0
+            
+            if removed:
+                logger.info(f"Pruned {removed} expired download metadata entries")
+            return removed
+            
+        except Exception as e:
+            logger.error(f"Metadata pruning failed: {e}")
+            return 0
+    
+    async def handle_url(self, url_or_query: str, chat_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Handle URL or search query, queueing behind the chat's other downloads."""
+        if chat_id is None:
+            return await self._handle_url(url_or_query)
+        
+        slot = self._chat_downloads.get(chat_id)
+        if slot is None:
+            slot = self._chat_downloads[chat_id] = asyncio.Semaphore(DOWNLOADS_PER_CHAT)
+        
+        async with slot:
+            return await self._handle_url(url_or_query)
+    
+    async def _handle_url(self, url_or_query: str) -> Optional[Dict[str, Any]]:
+        """Download a URL or the top hit of a search query."""
         if self.is_youtube_url(url_or_query):
-            # Direct URL
-            info = await self.get_video_info(url_or_query)
-            if info:
-                # Download the audio
-                return await self.download_audio(url_or_query)
-            else:
-                return None
+            # Direct URL; the download's extract_info also yields the metadata
+            return await self.download_audio(url_or_query)
         else:
-            # Search query
-            search_results = await self.search(url_or_query, limit=1)
-            if search_results:
-                video = search_results[0]
-                download_url = f"https://www.youtube.com/watch?v={video['id']}"
-                return await self.download_audio(download_url)
-            else:
-                return None
+            # Search query; search and download the top hit in one pass
+            return await self.download_audio(f"ytsearch1:{url_or_query}")
     
     def cleanup_old_files(self, max_age_hours: int = 24):
         """Clean up old downloaded files."""
         try:
-            import time
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600
-            
-            for file_path in self.download_dir.glob("*"):
-                if file_path.is_file():
-                    file_age = current_time - file_path.stat().st_mtime
-                    if file_age > max_age_seconds:
+            cutoff = time.time() - max_age_hours * 3600
+            
+            # scandir entries carry their own stat results, one syscall each
+            with os.scandir(self.download_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    
+                    if entry.stat(follow_symlinks=False).st_mtime < cutoff:
                         try:
-                            file_path.unlink()
-                            logger.info(f"Cleaned up old file: {file_path}")
-                        except Exception as e:
-                            logger.error(f"Failed to clean up {file_path}: {e}")
+                            os.unlink(entry.path)
+                            logger.info(f"Cleaned up old file: {entry.path}")
+                        except OSError as e:
+                            logger.error(f"Failed to clean up {entry.path}: {e}")
                             
         except Exception as e:
             logger.error(f"Cleanup failed: {e}")
@@ -2,14 +2,30 @@
 State management for persistent playback state across bot restarts.
 """
 import asyncio
-import json
 import logging
+import time
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Set
 from datetime import datetime
 
+from bot.helpers.jsonutil import json_loads
+
 logger = logging.getLogger(__name__)
 
+# Storage key prefix of per-chat playback state
+STATE_KEY_PREFIX = "playback_state:"
+STATE_KEY_PATTERN = STATE_KEY_PREFIX + "*"
+
+# Seconds a position may drift from the extrapolated one before it is saved
+POSITION_TOLERANCE = 2.0
+
+
+def _as_state(value: Any) -> Dict[str, Any]:
+    """Get a state dict from a stored value; older versions stored JSON strings."""
+    if isinstance(value, str):
+        return json_loads(value)
+    return value
+
 
 class StateManager:
     """Manages persistent playback state."""
@@ -20,8 +36,11 @@ class StateManager:
         self.state_dir = state_dir
         self.state_dir.mkdir(parents=True, exist_ok=True)
         self.save_interval = 15  # Save every 15 seconds
-        self.save_tasks: Dict[int, asyncio.Task] = {}
+        self.active_chats: Set[int] = set()
         self.pending_saves: Dict[int, Dict[str, Any]] = {}
+        # Chats whose pending state has not been written yet
+        self._dirty: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
     
     async def save_playback_state(
         self, 
@@ -32,16 +51,23 @@ class StateManager:
     ) -> bool:
         """Save current playback state."""
         try:
+            # Wall-clock time: last_updated is compared again after a restart
+            now = time.time()
+            
+            # Nothing to write if the restorer would derive the same state
+            if self._is_unchanged(chat_id, track_info, position, is_playing, now):
+                return True
+            
             state_data = {
                 "chat_id": chat_id,
                 "track": track_info,
                 "position": position,
                 "is_playing": is_playing,
-                "timestamp": datetime.now().isoformat(),
-                "last_updated": asyncio.get_event_loop().time()
+                "last_updated": now
             }
             
             self.pending_saves[chat_id] = state_data
+            self._dirty.add(chat_id)
             
             # Schedule immediate save for important state changes
             if not is_playing:  # Paused or stopped
@@ -53,17 +79,43 @@ class StateManager:
             logger.error(f"Failed to save state for chat {chat_id}: {e}")
             return False
     
+    def _is_unchanged(
+        self,
+        chat_id: int,
+        track_info: Dict[str, Any],
+        position: float,
+        is_playing: bool,
+        now: float
+    ) -> bool:
+        """Check if a state matches the pending one, allowing for playback progress."""
+        previous = self.pending_saves.get(chat_id)
+        if previous is None:
+            return False
+        
+        if (previous["is_playing"] != is_playing
+                or previous["track"].get("file_path") != track_info.get("file_path")):
+            return False
+        
+        # Playing positions are extrapolated from last_updated on restore
+        expected = previous["position"]
+        if is_playing:
+            expected += now - previous["last_updated"]
+        
+        return abs(position - expected) < POSITION_TOLERANCE
+    
     async def get_playback_state(self, chat_id: int) -> Optional[Dict[str, Any]]:
         """Get saved playback state for chat."""
         try:
-            state_key = f"playback_state:{chat_id}"
+            # The pending snapshot is what storage holds or is about to hold
+            pending = self.pending_saves.get(chat_id)
+            if pending is not None:
+                return pending
+            
+            state_key = f"{STATE_KEY_PREFIX}{chat_id}"
             state_data = await self.storage.get(state_key)
             
             if state_data:
-                # Parse the data if it's a string
-                if isinstance(state_data, str):
-                    state_data = json.loads(state_data)
-                
+                state_data = _as_state(state_data)
                 logger.info(f"Loaded playback state for chat {chat_id}")
                 return state_data
             
@@ -76,16 +128,12 @@ class StateManager:
     async def delete_playback_state(self, chat_id: int) -> bool:
         """Delete playback state for chat."""
         try:
-            state_key = f"playback_state:{chat_id}"
+            state_key = f"{STATE_KEY_PREFIX}{chat_id}"
             await self.storage.delete(state_key)
             
-            # Cancel any pending save tasks
-            if chat_id in self.save_tasks:
-                self.save_tasks[chat_id].cancel()
-                del self.save_tasks[chat_id]
-            
-            if chat_id in self.pending_saves:
-                del self.pending_saves[chat_id]
+            # Drop any pending save so the flusher cannot write it back
+            self.pending_saves.pop(chat_id, None)
+            self._dirty.discard(chat_id)
             
             logger.info(f"Deleted playback state for chat {chat_id}")
             return True
@@ -97,23 +145,12 @@ class StateManager:
     async def start_auto_save(self, chat_id: int) -> bool:
         """Start automatic periodic saving for chat."""
         try:
-            # Cancel existing task if any
-            if chat_id in self.save_tasks:
-                self.save_tasks[chat_id].cancel()
-            
-            # Create new auto-save task
-            async def auto_save():
-                while chat_id in self.save_tasks:
-                    try:
-                        await asyncio.sleep(self.save_interval)
-                        if chat_id in self.pending_saves:
-                            await self._perform_save(chat_id)
-                    except asyncio.CancelledError:
-                        break
-                    except Exception as e:
-                        logger.error(f"Auto-save error for chat {chat_id}: {e}")
-            
-            self.save_tasks[chat_id] = asyncio.create_task(auto_save())
+            self.active_chats.add(chat_id)
+            
+            # One flusher task saves every active chat per interval
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.create_task(self._flush_loop())
+            
             logger.info(f"Started auto-save for chat {chat_id}")
             return True
             
@@ -124,13 +161,15 @@ class StateManager:
     async def stop_auto_save(self, chat_id: int) -> bool:
         """Stop automatic saving for chat."""
         try:
-            if chat_id in self.save_tasks:
-                self.save_tasks[chat_id].cancel()
-                del self.save_tasks[chat_id]
+            self.active_chats.discard(chat_id)
             
-            # Perform final save
+            # Perform final save; once written the state only lives in storage,
+            # so pending_saves stays bounded by the number of active chats.
+            # A failed save keeps the snapshot for the shutdown flush.
             if chat_id in self.pending_saves:
-                await self._perform_save(chat_id)
+                saved = await self._perform_save(chat_id)
+                if saved and chat_id not in self.active_chats:
+                    self.pending_saves.pop(chat_id, None)
             
             logger.info(f"Stopped auto-save for chat {chat_id}")
             return True
@@ -139,6 +178,55 @@ class StateManager:
             logger.error(f"Failed to stop auto-save for chat {chat_id}: {e}")
             return False
     
+    async def stop_all_auto_saves(self) -> bool:
+        """Stop automatic saving for all chats with one final batched save."""
+        try:
+            if self._flush_task:
+                self._flush_task.cancel()
+                self._flush_task = None
+            
+            # Include chats whose final save failed after they stopped
+            await self._flush((self.active_chats | self._dirty) & self.pending_saves.keys())
+            self.active_chats.clear()
+            
+            logger.info("Stopped auto-save for all chats")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to stop auto-save: {e}")
+            return False
+    
+    async def _flush_loop(self):
+        """Periodically save changed state of all active chats."""
+        while self.active_chats:
+            try:
+                await asyncio.sleep(self.save_interval)
+                await self._flush(self._dirty & self.active_chats)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Auto-save error: {e}")
+    
+    async def _flush(self, chat_ids: Set[int]) -> bool:
+        """Save the pending state of several chats in one storage write."""
+        items = {
+            f"{STATE_KEY_PREFIX}{chat_id}": self.pending_saves[chat_id]
+            for chat_id in chat_ids
+            if chat_id in self.pending_saves
+        }
+        if not items:
+            return True
+        
+        # Changes arriving while the write is in flight mark the chat dirty again
+        self._dirty.difference_update(chat_ids)
+        
+        if not await self.storage.set_many(items):
+            self._dirty.update(chat_ids)
+            return False
+        
+        logger.debug(f"Saved state for {len(items)} chats")
+        return True
+    
     async def _perform_save(self, chat_id: int) -> bool:
         """Perform the actual save operation."""
         try:
@@ -146,10 +234,13 @@ class StateManager:
                 return False
             
             state_data = self.pending_saves[chat_id]
-            state_key = f"playback_state:{chat_id}"
+            state_key = f"{STATE_KEY_PREFIX}{chat_id}"
+            self._dirty.discard(chat_id)
             
-            # Store as JSON string
-            await self.storage.set(state_key, json.dumps(state_data))
+            # The backend encodes the value itself
+            if not await self.storage.set(state_key, state_data):
+                self._dirty.add(chat_id)
+                return False
             
             logger.debug(f"Saved state for chat {chat_id}")
             return True
@@ -162,16 +253,13 @@ class StateManager:
         """Get all saved playback states."""
         try:
             states = []
-            state_pattern = "playback_state:*"
+            state_pattern = STATE_KEY_PATTERN
             
             saved_states = await self.storage.get_pattern(state_pattern)
             
             for key, value in saved_states.items():
                 try:
-                    if isinstance(value, str):
-                        state_data = json.loads(value)
-                    else:
-                        state_data = value
+                    state_data = _as_state(value)
                     
                     states.append(state_data)
                 except Exception as e:
@@ -186,29 +274,39 @@ class StateManager:
     async def cleanup_old_states(self, max_age_hours: int = 24) -> int:
         """Clean up old playback states."""
         try:
-            cutoff_time = datetime.now().timestamp() - (max_age_hours * 3600)
-            cleaned_count = 0
+            # Backends that track write times delete stale rows themselves
+            cleaned_count = await self.storage.delete_older_than(
+                STATE_KEY_PATTERN, max_age_hours * 3600
+            )
+            if cleaned_count is not None:
+                logger.info(f"Cleaned up {cleaned_count} old states")
+                return cleaned_count
+            
+            cutoff_time = time.time() - (max_age_hours * 3600)
+            stale_keys = []
             
-            saved_states = await self.storage.get_pattern("playback_state:*")
+            saved_states = await self.storage.get_pattern(STATE_KEY_PATTERN)
             
             for key, value in saved_states.items():
                 try:
-                    if isinstance(value, str):
-                        state_data = json.loads(value)
-                    else:
-                        state_data = value
+                    state_data = _as_state(value)
                     
-                    # Check if state is old enough
+                    # Check if state is old enough; older versions only
+                    # carried a wall-clock time in the ISO timestamp field
                     timestamp = state_data.get("timestamp")
                     if timestamp:
                         state_time = datetime.fromisoformat(timestamp).timestamp()
-                        if state_time < cutoff_time:
-                            await self.storage.delete(key)
-                            cleaned_count += 1
+                    else:
+                        state_time = state_data.get("last_updated", 0)
+                    
+                    if state_time < cutoff_time:
+                        stale_keys.append(key)
                 
                 except Exception as e:
                     logger.error(f"Failed to process state {key} for cleanup: {e}")
             
+            cleaned_count = await self.storage.delete_many(stale_keys) if stale_keys else 0
+            
             logger.info(f"Cleaned up {cleaned_count} old states")
             return cleaned_count
             
@@ -220,20 +318,17 @@ class StateManager:
         """Restore all saved playback states on startup."""
         try:
             restored_states = {}
-            saved_states = await self.storage.get_pattern("playback_state:*")
+            saved_states = await self.storage.get_pattern(STATE_KEY_PATTERN)
             
             for key, value in saved_states.items():
                 try:
                     # Extract chat_id from key
-                    if key.startswith("playback_state:"):
-                        chat_id = int(key.split(":")[1])
+                    if key.startswith(STATE_KEY_PREFIX):
+                        chat_id = int(key[len(STATE_KEY_PREFIX):])
                     else:
                         continue
                     
-                    if isinstance(value, str):
-                        state_data = json.loads(value)
-                    else:
-                        state_data = value
+                    state_data = _as_state(value)
                     
                     # Calculate current position
                     last_updated = state_data.get("last_updated", 0)
@@ -241,8 +336,7 @@ class StateManager:
                     
                     # If was playing, estimate current position
                     if state_data.get("is_playing", False) and last_updated > 0:
-                        current_time = asyncio.get_event_loop().time()
-                        time_diff = current_time - last_updated
+                        time_diff = time.time() - last_updated
                         
                         # Assume average track duration for estimation
                         track_duration = state_data.get("track", {}).get("duration", 300)
@@ -265,7 +359,8 @@ class StateManager:
     def get_state_summary(self) -> Dict[str, Any]:
         """Get summary of current state."""
         return {
-            "active_chats": len(self.save_tasks),
+            "active_chats": len(self.active_chats),
             "pending_saves": len(self.pending_saves),
+            "unsaved_chats": len(self._dirty),
             "save_interval": self.save_interval
         }
@@ -1,15 +1,72 @@
 """
-Storage abstraction layer for different backends (memory, TinyDB, SQLite).
+Storage abstraction layer for different backends (memory, SQLite).
 """
 import asyncio
+import json
 import logging
+import os
+import time
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Union
+
+from bot.helpers.jsonutil import json_dumps, json_loads
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 logger = logging.getLogger(__name__)
 
 
+class ValueDecodeError(ValueError):
+    """A stored value cannot be decoded with the installed codecs."""
+
+
+# Reused MessagePack codec for stored values (JSON text without msgspec)
+if msgspec is not None:
+    _msgpack_encoder = msgspec.msgpack.Encoder()
+    _msgpack_decoder = msgspec.msgpack.Decoder()
+    _DECODE_ERRORS = (json.JSONDecodeError, msgspec.DecodeError, ValueDecodeError)
+else:
+    _msgpack_encoder = None
+    _msgpack_decoder = None
+    _DECODE_ERRORS = (json.JSONDecodeError, ValueDecodeError)
+
+
+def encode_value(value: Any) -> Union[bytes, str]:
+    """Encode a value for storage, as MessagePack when available."""
+    if _msgpack_encoder is not None:
+        return _msgpack_encoder.encode(value)
+    return json_dumps(value)
+
+
+def decode_value(raw: Union[bytes, str]) -> Any:
+    """Decode a stored value; JSON text rows from older versions still load."""
+    if isinstance(raw, bytes):
+        if _msgpack_decoder is None:
+            raise ValueDecodeError("MessagePack value stored but msgspec is not installed")
+        return _msgpack_decoder.decode(raw)
+    return json_loads(raw)
+
+
+# File name of the SQLite state database in the download directory; the
+# download cleanup must skip it and its -wal/-shm companions
+STATE_DB_NAME = "state.db"
+
+# Every SQLite database file starts with this header
+_SQLITE_HEADER = b"SQLite format 3\x00"
+
+# Sentinel telling a stored None apart from a missing key
+_MISSING = object()
+
+
+def _prefix_range(prefix: str) -> Tuple[str, str]:
+    """Get the half-open key range [lower, upper) holding every key with prefix."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
 class StorageBackend(ABC):
     """Abstract storage backend."""
     
@@ -37,6 +94,24 @@ class StorageBackend(ABC):
     async def get_pattern(self, pattern: str) -> Dict[str, Any]:
         """Get all keys matching pattern."""
         pass
+    
+    async def set_many(self, items: Dict[str, Any]) -> bool:
+        """Set several keys; backends override this to write in one batch."""
+        results = [await self.set(key, value) for key, value in items.items()]
+        return all(results)
+    
+    async def delete_many(self, keys: List[str]) -> int:
+        """Delete several keys; backends override this to delete in one batch."""
+        results = [await self.delete(key) for key in keys]
+        return sum(results)
+    
+    async def delete_older_than(self, pattern: str, max_age_seconds: float) -> Optional[int]:
+        """Delete keys matching pattern not written for max_age_seconds; None if unsupported."""
+        return None
+    
+    async def close(self):
+        """Release any resources held by the backend."""
+        pass
 
 
 class MemoryStorage(StorageBackend):
@@ -44,210 +119,155 @@ class MemoryStorage(StorageBackend):
     
     def __init__(self):
         """Initialize memory storage."""
+        # No lock: nothing here awaits, so each call runs atomically on the loop
         self.data: Dict[str, Any] = {}
-        self._lock = asyncio.Lock()
     
     async def get(self, key: str) -> Optional[Any]:
         """Get value by key."""
-        async with self._lock:
-            return self.data.get(key)
+        return self.data.get(key)
     
     async def set(self, key: str, value: Any) -> bool:
         """Set value by key."""
-        async with self._lock:
-            self.data[key] = value
-            return True
+        self.data[key] = value
+        return True
     
     async def delete(self, key: str) -> bool:
         """Delete key."""
-        async with self._lock:
-            if key in self.data:
-                del self.data[key]
-                return True
-            return False
+        return self.data.pop(key, _MISSING) is not _MISSING
     
     async def exists(self, key: str) -> bool:
         """Check if key exists."""
-        async with self._lock:
-            return key in self.data
+        return key in self.data
     
     async def get_pattern(self, pattern: str) -> Dict[str, Any]:
         """Get all keys matching pattern."""
-        async with self._lock:
-            result = {}
-            if pattern.endswith('*'):
-                prefix = pattern[:-1]
-                for k, v in self.data.items():
-                    if k.startswith(prefix):
-                        result[k] = v
-            else:
-                # Exact match
-                if pattern in self.data:
-                    result[pattern] = self.data[pattern]
-            return result
-
-
-class TinyDBStorage(StorageBackend):
-    """TinyDB storage backend."""
-    
-    def __init__(self, db_path: Path):
-        """Initialize TinyDB storage."""
-        self.db_path = db_path
-        self._initialized = False
-        self._lock = asyncio.Lock()
-    
-    async def _ensure_initialized(self):
-        """Ensure TinyDB is initialized."""
-        if not self._initialized:
-            try:
-                from tinydb import TinyDB
-                from tinydb.storages import JSONStorage
-                
-                # Ensure directory exists
-                self.db_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                self.db = TinyDB(
-                    self.db_path,
-                    storage=JSONStorage,
-                    indent=2
-                )
-                self._initialized = True
-                
-            except ImportError:
-                logger.error("TinyDB not available, falling back to memory storage")
-                raise ImportError("TinyDB not installed")
-    
-    async def get(self, key: str) -> Optional[Any]:
-        """Get value by key."""
-        try:
-            await self._ensure_initialized()
-            async with self._lock:
-                doc = self.db.get(doc_id=key)
-                return doc.get('value') if doc else None
-        except Exception as e:
-            logger.error(f"TinyDB get error for key {key}: {e}")
-            return None
-    
-    async def set(self, key: str, value: Any) -> bool:
-        """Set value by key."""
-        try:
-            await self._ensure_initialized()
-            async with self._lock:
-                doc = self.db.get(doc_id=key)
-                if doc:
-                    doc['value'] = value
-                    self.db.update(doc, doc_ids=[key])
-                else:
-                    self.db.insert({'_id': key, 'value': value})
-                return True
-        except Exception as e:
-            logger.error(f"TinyDB set error for key {key}: {e}")
-            return False
-    
-    async def delete(self, key: str) -> bool:
-        """Delete key."""
-        try:
-            await self._ensure_initialized()
-            async with self._lock:
-                doc = self.db.get(doc_id=key)
-                if doc:
-                    self.db.remove(doc_ids=[key])
-                    return True
-                return False
-        except Exception as e:
-            logger.error(f"TinyDB delete error for key {key}: {e}")
-            return False
-    
-    async def exists(self, key: str) -> bool:
-        """Check if key exists."""
-        try:
-            await self._ensure_initialized()
-            async with self._lock:
-                doc = self.db.get(doc_id=key)
-                return doc is not None
-        except Exception as e:
-            logger.error(f"TinyDB exists error for key {key}: {e}")
-            return False
-    
-    async def get_pattern(self, pattern: str) -> Dict[str, Any]:
-        """Get all keys matching pattern."""
-        try:
-            await self._ensure_initialized()
-            async with self._lock:
-                result = {}
-                docs = self.db.all()
-                
-                for doc in docs:
-                    key = doc.get('_id')
-                    value = doc.get('value')
-                    
-                    if pattern.endswith('*'):
-                        prefix = pattern[:-1]
-                        if key and key.startswith(prefix):
-                            result[key] = value
-                    else:
-                        if key == pattern:
-                            result[key] = value
-                            break
-                
-                return result
-        except Exception as e:
-            logger.error(f"TinyDB pattern error for pattern {pattern}: {e}")
-            return {}
+        if pattern.endswith('*'):
+            prefix = pattern[:-1]
+            return {k: v for k, v in self.data.items() if k.startswith(prefix)}
+        
+        # Exact match
+        if pattern in self.data:
+            return {pattern: self.data[pattern]}
+        return {}
 
 
 class SQLiteStorage(StorageBackend):
     """SQLite storage backend."""
     
-    def __init__(self, db_path: Path):
+    def __init__(self, db_path: Path, legacy_json: Optional[Path] = None):
         """Initialize SQLite storage."""
         self.db_path = db_path
+        self.legacy_json = legacy_json
         self._initialized = False
         self._lock = asyncio.Lock()
+        self._db = None
     
     async def _ensure_initialized(self):
         """Ensure SQLite is initialized."""
         if not self._initialized:
-            try:
-                import aiosqlite
+            # Concurrent first calls must not open two connections
+            async with self._lock:
+                if self._initialized:
+                    return
+                
+                try:
+                    import aiosqlite
+                except ImportError:
+                    logger.error("aiosqlite not available, falling back to memory storage")
+                    raise ImportError("aiosqlite not installed")
                 
                 # Ensure directory exists
                 self.db_path.parent.mkdir(parents=True, exist_ok=True)
                 
-                async with aiosqlite.connect(self.db_path) as db:
+                # One connection is kept open for the lifetime of the backend
+                db = await aiosqlite.connect(self.db_path)
+                try:
+                    db.row_factory = aiosqlite.Row
+                    
+                    await db.execute('PRAGMA journal_mode=WAL')
+                    await db.execute('PRAGMA synchronous=NORMAL')
+                    await db.execute('PRAGMA temp_store=MEMORY')
+                    await db.execute('PRAGMA mmap_size=268435456')
+                    # Wait out another process's write lock instead of failing
+                    await db.execute('PRAGMA busy_timeout=5000')
                     await db.execute('''
                         CREATE TABLE IF NOT EXISTS key_value (
                             key TEXT PRIMARY KEY,
-                            value TEXT,
-                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            value BLOB,
+                            updated_at REAL
                         )
                     ''')
+                    # Older databases stored CURRENT_TIMESTAMP text; convert to epoch seconds
+                    await db.execute('''
+                        UPDATE key_value
+                        SET updated_at = CAST(strftime('%s', updated_at) AS REAL)
+                        WHERE typeof(updated_at) = 'text'
+                    ''')
+                    await db.execute(
+                        'CREATE INDEX IF NOT EXISTS idx_key_value_updated_at ON key_value (updated_at)'
+                    )
                     await db.commit()
+                    
+                    if self.legacy_json is not None:
+                        await self._import_legacy_json(db)
+                except BaseException:
+                    # Don't leave a half-initialised connection (and its thread) behind
+                    await db.close()
+                    raise
                 
+                self._db = db
                 self._initialized = True
-                
-            except ImportError:
-                logger.error("aiosqlite not available, falling back to memory storage")
-                raise ImportError("aiosqlite not installed")
+    
+    async def _import_legacy_json(self, db):
+        """Copy the documents of an old TinyDB JSON file into the database."""
+        legacy_json, self.legacy_json = self.legacy_json, None
+        try:
+            data = json_loads(await asyncio.to_thread(legacy_json.read_bytes))
+            
+            # TinyDB never found existing documents, so a key may repeat;
+            # higher doc ids were written later and win
+            values = {}
+            for table in data.values():
+                for _, doc in sorted(table.items(), key=lambda item: int(item[0])):
+                    if isinstance(doc, dict) and '_id' in doc:
+                        values[doc['_id']] = doc.get('value')
+            
+            now = time.time()
+            await db.executemany(
+                '''
+                INSERT OR IGNORE INTO key_value (key, value, updated_at)
+                VALUES (?, ?, ?)
+                ''',
+                [(key, encode_value(value), now) for key, value in values.items()]
+            )
+            await db.commit()
+            logger.warning(f"Imported {len(values)} keys from the old TinyDB file {legacy_json}")
+        
+        except Exception as e:
+            logger.error(f"Failed to import the old TinyDB file, its data was left in {legacy_json}: {e}")
+    
+    async def close(self):
+        """Close the database connection."""
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+            self._initialized = False
     
     async def get(self, key: str) -> Optional[Any]:
         """Get value by key."""
         try:
             await self._ensure_initialized()
-            import aiosqlite
-            import json
             
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                cursor = await db.execute(
+            async with self._lock:
+                cursor = await self._db.execute(
                     'SELECT value FROM key_value WHERE key = ?', 
                     (key,)
                 )
                 row = await cursor.fetchone()
-                
-                if row:
-                    return json.loads(row['value'])
-                return None
+            
+            if row:
+                return decode_value(row['value'])
+            return None
                 
         except Exception as e:
             logger.error(f"SQLite get error for key {key}: {e}")
@@ -257,56 +277,92 @@ class SQLiteStorage(StorageBackend):
         """Set value by key."""
         try:
             await self._ensure_initialized()
-            import aiosqlite
-            import json
+            value_data = encode_value(value)
             
-            async with aiosqlite.connect(self.db_path) as db:
-                value_str = json.dumps(value)
-                await db.execute(
+            async with self._lock:
+                await self._db.execute(
                     '''
                     INSERT OR REPLACE INTO key_value (key, value, updated_at)
-                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    VALUES (?, ?, ?)
                     ''',
-                    (key, value_str)
+                    (key, value_data, time.time())
                 )
-                await db.commit()
-                return True
+                await self._db.commit()
+            return True
                 
         except Exception as e:
             logger.error(f"SQLite set error for key {key}: {e}")
             return False
     
+    async def set_many(self, items: Dict[str, Any]) -> bool:
+        """Set several keys in a single transaction."""
+        try:
+            await self._ensure_initialized()
+            now = time.time()
+            rows = [(key, encode_value(value), now) for key, value in items.items()]
+            
+            async with self._lock:
+                await self._db.executemany(
+                    '''
+                    INSERT OR REPLACE INTO key_value (key, value, updated_at)
+                    VALUES (?, ?, ?)
+                    ''',
+                    rows
+                )
+                await self._db.commit()
+            return True
+                
+        except Exception as e:
+            logger.error(f"SQLite set_many error for {len(items)} keys: {e}")
+            return False
+    
     async def delete(self, key: str) -> bool:
         """Delete key."""
         try:
             await self._ensure_initialized()
-            import aiosqlite
             
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute(
+            async with self._lock:
+                cursor = await self._db.execute(
                     'DELETE FROM key_value WHERE key = ?', 
                     (key,)
                 )
-                await db.commit()
-                return cursor.rowcount > 0
+                await self._db.commit()
+            return cursor.rowcount > 0
                 
         except Exception as e:
             logger.error(f"SQLite delete error for key {key}: {e}")
             return False
     
+    async def delete_many(self, keys: List[str]) -> int:
+        """Delete several keys in a single transaction."""
+        try:
+            await self._ensure_initialized()
+            
+            async with self._lock:
+                # executemany's rowcount sums the rows deleted by every key
+                cursor = await self._db.executemany(
+                    'DELETE FROM key_value WHERE key = ?',
+                    [(key,) for key in keys]
+                )
+                await self._db.commit()
+            return cursor.rowcount
+                
+        except Exception as e:
+            logger.error(f"SQLite delete_many error for {len(keys)} keys: {e}")
+            return 0
+    
     async def exists(self, key: str) -> bool:
         """Check if key exists."""
         try:
             await self._ensure_initialized()
-            import aiosqlite
             
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute(
+            async with self._lock:
+                cursor = await self._db.execute(
                     'SELECT 1 FROM key_value WHERE key = ?', 
                     (key,)
                 )
                 row = await cursor.fetchone()
-                return row is not None
+            return row is not None
                 
         except Exception as e:
             logger.error(f"SQLite exists error for key {key}: {e}")
@@ -316,39 +372,80 @@ class SQLiteStorage(StorageBackend):
         """Get all keys matching pattern."""
         try:
             await self._ensure_initialized()
-            import aiosqlite
-            import json
             
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                
-                if pattern.endswith('*'):
-                    prefix = pattern[:-1]
-                    cursor = await db.execute(
-                        'SELECT key, value FROM key_value WHERE key LIKE ?',
-                        (f'{prefix}%',)
+            async with self._lock:
+                if pattern == '*':
+                    cursor = await self._db.execute('SELECT key, value FROM key_value')
+                elif pattern.endswith('*'):
+                    # A half-open key range is always an index range scan on
+                    # the primary key, unlike LIKE (where '_' is a wildcard too)
+                    cursor = await self._db.execute(
+                        'SELECT key, value FROM key_value WHERE key >= ? AND key < ?',
+                        _prefix_range(pattern[:-1])
                     )
                 else:
-                    cursor = await db.execute(
+                    cursor = await self._db.execute(
                         'SELECT key, value FROM key_value WHERE key = ?',
                         (pattern,)
                     )
                 
-                rows = await cursor.fetchall()
+                # Decode rows as the cursor streams them in rather than
+                # materialising the whole result set first
                 result = {}
-                
-                for row in rows:
+                async for row in cursor:
                     try:
-                        value = json.loads(row['value'])
-                        result[row['key']] = value
-                    except json.JSONDecodeError:
-                        logger.warning(f"Failed to parse JSON for key {row['key']}")
-                
-                return result
+                        result[row['key']] = decode_value(row['value'])
+                    except _DECODE_ERRORS:
+                        logger.warning(f"Failed to decode value for key {row['key']}")
+            
+            return result
                 
         except Exception as e:
             logger.error(f"SQLite pattern error for pattern {pattern}: {e}")
             return {}
+    
+    async def delete_older_than(self, pattern: str, max_age_seconds: float) -> Optional[int]:
+        """Delete keys matching a prefix pattern in one statement, by write time."""
+        if not pattern.endswith('*') or pattern == '*':
+            return None
+        
+        try:
+            await self._ensure_initialized()
+            lower, upper = _prefix_range(pattern[:-1])
+            
+            async with self._lock:
+                cursor = await self._db.execute(
+                    'DELETE FROM key_value WHERE key >= ? AND key < ? AND updated_at < ?',
+                    (lower, upper, time.time() - max_age_seconds)
+                )
+                await self._db.commit()
+            return cursor.rowcount
+                
+        except Exception as e:
+            logger.error(f"SQLite delete_older_than error for pattern {pattern}: {e}")
+            return None
+
+
+def _move_legacy_tinydb_file(db_path: Path) -> Optional[Path]:
+    """Move an old TinyDB JSON file off db_path so SQLite can create its database there."""
+    try:
+        with open(db_path, "rb") as f:
+            header = f.read(len(_SQLITE_HEADER))
+    except FileNotFoundError:
+        return None
+    
+    # SQLite happily adopts an empty file
+    if not header or header == _SQLITE_HEADER:
+        return None
+    
+    # Keep the state.db prefix so the download cleanup leaves it alone
+    legacy_json = db_path.with_name(f"{db_path.name}.tinydb-{int(time.time())}.json")
+    os.replace(db_path, legacy_json)
+    logger.warning(
+        f"{db_path} held TinyDB data; moved it to {legacy_json}, "
+        "its keys will be imported into the new SQLite database"
+    )
+    return legacy_json
 
 
 def create_storage_backend(backend_type: str, db_path: Path) -> StorageBackend:
@@ -358,7 +455,9 @@ def create_storage_backend(backend_type: str, db_path: Path) -> StorageBackend:
     if backend_type == "memory":
         return MemoryStorage()
     elif backend_type == "tinydb":
-        return TinyDBStorage(db_path)
+        # The TinyDB backend reparsed its whole JSON file on every scan
+        logger.warning("The tinydb backend has been removed, using sqlite storage")
+        return SQLiteStorage(db_path, legacy_json=_move_legacy_tinydb_file(db_path))
     elif backend_type == "sqlite":
         return SQLiteStorage(db_path)
     else:
@@ -1,12 +1,17 @@
 """
 Playback control command handlers.
 """
+import asyncio
 import logging
+from typing import Awaitable, Callable, Dict
+
 from pyrogram import Client, filters
+from pyrogram.enums import ChatType
 from pyrogram.types import Message, CallbackQuery
 
 from bot.client import BotClient
 from bot.helpers.localization import Localization
+from bot.helpers.keyboards import KeyboardBuilder
 
 logger = logging.getLogger(__name__)
 
@@ -39,7 +44,7 @@ async def pause_command(client: BotClient, message: Message):
             )
         
     except Exception as e:
-        logger.error(f"Error handling pause command: {e}")
+        logger.exception("Error handling pause command: %s", e)
         await message.reply(
             client.localization.get_text(0, "error_messages.general_error", error=str(e))
         )
@@ -66,10 +71,11 @@ async def resume_command(client: BotClient, message: Message):
             
             if success:
                 # Start progress updater
-                if chat_id in client.player.current_messages:
+                message_id = client.player.current_messages.get(chat_id)
+                if message_id is not None:
                     await client.player.start_progress_updater(
                         chat_id,
-                        client.player.current_messages[chat_id],
+                        message_id,
                         client._update_now_playing_message
                     )
                 
@@ -102,7 +108,7 @@ async def resume_command(client: BotClient, message: Message):
                 )
         
     except Exception as e:
-        logger.error(f"Error handling resume command: {e}")
+        logger.exception("Error handling resume command: %s", e)
         await message.reply(
             client.localization.get_text(0, "error_messages.general_error", error=str(e))
         )
@@ -117,22 +123,15 @@ async def stop_command(client: BotClient, message: Message):
         if not await _check_admin_privileges(client, message):
             return
         
-        # Stop playback and leave voice chat
-        await client.player.stop_playback(chat_id)
-        await client.player.leave_voice_chat(chat_id)
-        
-        # Stop auto-save
-        await client.state_manager.stop_auto_save(chat_id)
-        
-        # Clear queue
-        client.queue_manager.clear_queue(chat_id)
+        # Leave voice chat, stop auto-save and clear the queue
+        await client.end_session(chat_id)
         
         await message.reply(
             client.localization.get_text(chat_id, "status_messages.left_voice_chat")
         )
         
     except Exception as e:
-        logger.error(f"Error handling stop command: {e}")
+        logger.exception("Error handling stop command: %s", e)
         await message.reply(
             client.localization.get_text(0, "error_messages.general_error", error=str(e))
         )
@@ -150,50 +149,43 @@ async def skip_command(client: BotClient, message: Message):
             )
             return
         
-        # Skip current track
-        await client.player.skip_track(chat_id)
-        
-        # Get next track
-        next_track = client.queue_manager.get_next_track(chat_id)
-        
-        if next_track:
-            # Start next track
-            success = await client.player.play_audio(chat_id, next_track.file_path)
+        async with client.queue_manager.lock(chat_id):
+            # Get next track
+            next_track = client.queue_manager.get_next_track(chat_id)
             
-            if success:
-                # Update now playing message
-                await client._update_now_playing_message(chat_id)
+            if next_track:
+                # Start next track (play_audio stops the current one itself)
+                success = await client.player.play_audio(chat_id, next_track.file_path)
                 
-                # Restart progress updater
-                if chat_id in client.player.current_messages:
-                    await client.player.start_progress_updater(
-                        chat_id,
-                        client.player.current_messages[chat_id],
-                        client._update_now_playing_message
+                if success:
+                    # Update now playing message while replying
+                    await asyncio.gather(
+                        client._update_now_playing_message(chat_id),
+                        message.reply(
+                            client.localization.get_text(chat_id, "status_messages.track_skipped")
+                        )
+                    )
+                    
+                    # Restart progress updater
+                    message_id = client.player.current_messages.get(chat_id)
+                    if message_id is not None:
+                        await client.player.start_progress_updater(
+                            chat_id,
+                            message_id,
+                            client._update_now_playing_message
+                        )
+                else:
+                    await message.reply(
+                        client.localization.get_text(chat_id, "error_messages.general_error", error="Failed to start next track")
                     )
-                
-                await message.reply(
-                    client.localization.get_text(chat_id, "status_messages.track_skipped")
-                )
             else:
-                await message.reply(
-                    client.localization.get_text(chat_id, "error_messages.general_error", error="Failed to start next track")
-                )
-        else:
-            # No more tracks, stop playback
-            await client.player.stop_playback(chat_id)
-            await client.player.leave_voice_chat(chat_id)
-            
-            # Stop auto-save
-            await client.state_manager.stop_auto_save(chat_id)
-            
-            # Clear queue
-            client.queue_manager.clear_queue(chat_id)
-            
-            await message.reply("🎵 Queue finished!")
+                # No more tracks, end the session
+                await client.end_session(chat_id)
+                
+                await message.reply("🎵 Queue finished!")
         
     except Exception as e:
-        logger.error(f"Error handling skip command: {e}")
+        logger.exception("Error handling skip command: %s", e)
         await message.reply(
             client.localization.get_text(0, "error_messages.general_error", error=str(e))
         )
@@ -202,34 +194,61 @@ async def skip_command(client: BotClient, message: Message):
 async def _check_admin_privileges(client: BotClient, message: Message) -> bool:
     """Check if user has admin privileges."""
     try:
-        if message.chat.type == "private":
+        if message.chat.type is ChatType.PRIVATE:
             return False
         
-        # Get chat member info
-        chat_member = await client.bot.get_chat_member(
-            message.chat.id, 
-            message.from_user.id
-        )
-        
         # Check if user is admin or owner
-        if chat_member.status in ["administrator", "owner"]:
+        if await client.is_chat_admin(message.chat.id, message.from_user.id):
             return True
         
         # Send admin required message
-        message.reply(
+        await message.reply(
             client.localization.get_text(message.chat.id, "admin_only")
         )
         return False
         
     except Exception as e:
-        logger.error(f"Error checking admin privileges: {e}")
+        logger.exception("Error checking admin privileges: %s", e)
         return False
 
 
+async def _on_volume(client: BotClient, callback: CallbackQuery, chat_id: int):
+    """Handle volume buttons."""
+    await callback.answer("Volume control not implemented yet")
+
+
+async def _on_loop_toggle(client: BotClient, callback: CallbackQuery, chat_id: int):
+    """Toggle loop mode."""
+    queue_manager = client.queue_manager
+    current_loop = queue_manager.is_looping(chat_id)
+    queue_manager.set_loop_mode(chat_id, not current_loop)
+    
+    status = "enabled" if not current_loop else "disabled"
+    await callback.answer(f"Loop mode {status}")
+
+
+async def _on_shuffle_queue(client: BotClient, callback: CallbackQuery, chat_id: int):
+    """Shuffle the queue."""
+    success = client.queue_manager.shuffle_queue(chat_id)
+    
+    if success:
+        await callback.answer("Queue shuffled!")
+    else:
+        await callback.answer("Cannot shuffle queue")
+
+
+# Control callback action -> handler, built once at import
+CONTROL_ACTIONS: Dict[str, Callable[[BotClient, CallbackQuery, int], Awaitable[None]]] = {
+    "volume_up": _on_volume,
+    "volume_down": _on_volume,
+    "loop_toggle": _on_loop_toggle,
+    "shuffle_queue": _on_shuffle_queue,
+}
+
+
 async def controls_callback(client: BotClient, callback: CallbackQuery):
     """Handle control-related callbacks."""
     try:
-        from bot.helpers.keyboards import KeyboardBuilder
         data = KeyboardBuilder.parse_callback_data(callback.data)
         
         chat_id = data.get("chat_id", 0)
@@ -238,65 +257,22 @@ async def controls_callback(client: BotClient, callback: CallbackQuery):
         if not await _verify_callback_access(client, callback, chat_id):
             return
         
-        action = data["action"]
-        
-        if action == "volume_up":
-            await callback.answer("Volume control not implemented yet")
-            
-        elif action == "volume_down":
-            await callback.answer("Volume control not implemented yet")
-            
-        elif action == "loop_toggle":
-            # Toggle loop mode
-            current_loop = client.queue_manager.is_looping(chat_id)
-            client.queue_manager.set_loop_mode(chat_id, not current_loop)
-            
-            status = "enabled" if not current_loop else "disabled"
-            await callback.answer(f"Loop mode {status}")
-            
-            # Update settings menu
-            await _update_settings_menu(client, chat_id, callback)
-            
-        elif action == "shuffle_queue":
-            # Shuffle queue
-            success = client.queue_manager.shuffle_queue(chat_id)
-            
-            if success:
-                await callback.answer("Queue shuffled!")
-            else:
-                await callback.answer("Cannot shuffle queue")
-            
-            # Update settings menu
-            await _update_settings_menu(client, chat_id, callback)
-            
-        elif action == "player_back":
-            # Return to player view
-            await client._update_now_playing_message(chat_id)
-            await callback.answer("Returned to player")
+        handler = CONTROL_ACTIONS.get(data["action"])
+        if handler is not None:
+            await handler(client, callback, chat_id)
             
     except Exception as e:
-        logger.error(f"Error handling controls callback: {e}")
+        logger.exception("Error handling controls callback: %s", e)
         await callback.answer("❌ An error occurred")
 
 
-async def _update_settings_menu(client: BotClient, chat_id: int, callback: CallbackQuery):
-    """Update settings menu message."""
-    try:
-        settings_keyboard = client.keyboards.build_settings_menu(chat_id, client.localization)
-        
-        await callback.message.edit_reply_markup(settings_keyboard)
-        
-    except Exception as e:
-        logger.error(f"Error updating settings menu: {e}")
-
-
 async def _verify_callback_access(client: BotClient, callback: CallbackQuery, chat_id: int) -> bool:
     """Verify callback access."""
     try:
         # Basic rate limiting check could be added here
         return True
     except Exception as e:
-        logger.error(f"Error verifying callback access: {e}")
+        logger.exception("Error verifying callback access: %s", e)
         return False
 
 
@@ -319,6 +295,6 @@ def register_handlers(app: Client, bot_client: BotClient):
     async def handle_skip(client: Client, message: Message):
         await skip_command(bot_client, message)
     
-    @app.on_callback_query(filters.regex("^(volume_|loop_|shuffle_|player_back)"))
+    @app.on_callback_query(filters.regex("^(volume_|loop_|shuffle_)"))
     async def handle_controls_callback(client: Client, callback: CallbackQuery):
-        await controls_callback(bot_client, callback)
+        bot_client.dispatch_callback(callback, controls_callback, bot_client, callback)
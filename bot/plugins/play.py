@@ -3,13 +3,14 @@ Music playback command handlers.
 """
 import asyncio
 import logging
-from typing import Optional
+from typing import Awaitable, Callable, Dict, Optional
 
 from pyrogram import Client, filters
+from pyrogram.enums import ChatType
 from pyrogram.types import Message, CallbackQuery
 from pyrogram.errors import ChatAdminRequired
 
-from bot.client import BotClient
+from bot.client import BotClient, CALLBACK_CACHE_TIME
 from bot.helpers.localization import Localization
 from bot.helpers.keyboards import KeyboardBuilder
 from bot.helpers.formatting import Formatter
@@ -17,6 +18,45 @@ from bot.core.queue import Track
 
 logger = logging.getLogger(__name__)
 
+# Seconds /play may take before a processing message is shown
+PROCESSING_MESSAGE_DELAY = 0.3
+
+
+class _StatusReply:
+    """Reply that only shows a processing message when the answer is slow."""
+    
+    def __init__(self, message: Message, placeholder: str):
+        """Start the processing message countdown."""
+        self.message = message
+        self.placeholder = placeholder
+        self.sent: Optional[Message] = None
+        self._deadline = asyncio.get_running_loop().time() + PROCESSING_MESSAGE_DELAY
+    
+    async def wait(self, awaitable):
+        """Await a step, sending the processing message once the deadline passes."""
+        task = asyncio.ensure_future(awaitable)
+        try:
+            if self.sent is None:
+                timeout = max(0.0, self._deadline - asyncio.get_running_loop().time())
+                done, _ = await asyncio.wait({task}, timeout=timeout)
+                if not done:
+                    self.sent = await self.message.reply(self.placeholder)
+            return await task
+        finally:
+            # Don't leave the step running, or its error unretrieved, if the
+            # wait or reply failed
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+    
+    async def send(self, text: str, **kwargs):
+        """Show the final text, editing the processing message if one was sent."""
+        if self.sent is None:
+            self.sent = await self.message.reply(text, **kwargs)
+        else:
+            await self.sent.edit_text(text, **kwargs)
+
 
 async def play_command(client: BotClient, message: Message):
     """Handle /play command."""
@@ -25,7 +65,7 @@ async def play_command(client: BotClient, message: Message):
         user_id = message.from_user.id if message.from_user else None
         
         # Check if this is a group chat (required for voice chats)
-        if message.chat.type == "private":
+        if message.chat.type is ChatType.PRIVATE:
             await message.reply(
                 client.localization.get_text(chat_id, "error_messages.private_chat")
             )
@@ -40,31 +80,30 @@ async def play_command(client: BotClient, message: Message):
         
         query = " ".join(message.command[1:])
         
-        # Send processing message
-        processing_msg = await message.reply(
-            client.localization.get_text(chat_id, "processing")
-        )
+        # Fast requests get a single reply; slow ones show a processing
+        # message first and edit it with the result
+        status = _StatusReply(message, client.localization.get_text(chat_id, "processing"))
         
         try:
             # Ensure assistant is setup for this chat
-            if not await client.assistant_manager.setup_assistant_for_chat(chat_id):
-                await processing_msg.edit_text(
+            if not await status.wait(client.assistant_manager.setup_assistant_for_chat(chat_id)):
+                await status.send(
                     client.localization.get_text(chat_id, "error_messages.chat_admin_required")
                 )
                 return
             
             # Start voice chat if needed
-            if not await client.player.join_voice_chat(chat_id):
-                await processing_msg.edit_text(
+            if not await status.wait(client.player.join_voice_chat(chat_id)):
+                await status.send(
                     client.localization.get_text(chat_id, "error_messages.not_in_voice_chat")
                 )
                 return
             
-            # Search or download music
-            track_info = await client.youtube.handle_url(query)
+            # Search or download music; one chat can't take every download worker
+            track_info = await status.wait(client.youtube.handle_url(query, chat_id))
             
             if not track_info:
-                await processing_msg.edit_text(
+                await status.send(
                     client.localization.get_text(chat_id, "status_messages.invalid_search", query=query)
                 )
                 return
@@ -85,84 +124,141 @@ async def play_command(client: BotClient, message: Message):
                 }
             )
             
-            # Add to queue
-            queue_length = client.queue_manager.get_queue_length(chat_id)
-            client.queue_manager.add_track(chat_id, track)
-            
-            # Format messages
-            if queue_length == 0:
-                # First track, start playing immediately
-                success = await client.player.play_audio(chat_id, track.file_path)
+            async with client.queue_manager.lock(chat_id):
+                # Add to queue
+                queue_length = client.queue_manager.get_queue_length(chat_id)
+                client.queue_manager.add_track(chat_id, track)
                 
-                if success:
-                    # Send now playing message
-                    await client._update_now_playing_message(chat_id)
+                # Format messages
+                if queue_length == 0:
+                    # First track, start playing immediately
+                    success = await client.player.play_audio(chat_id, track.file_path)
                     
-                    # Start progress updater and auto-save
-                    if chat_id in client.player.current_messages:
-                        await client.player.start_progress_updater(
-                            chat_id,
-                            client.player.current_messages[chat_id],
-                            client._update_now_playing_message
+                    if success:
+                        # Send now playing message
+                        await client._update_now_playing_message(chat_id)
+                        
+                        # Start progress updater and auto-save
+                        message_id = client.player.current_messages.get(chat_id)
+                        if message_id is not None:
+                            await client.player.start_progress_updater(
+                                chat_id,
+                                message_id,
+                                client._update_now_playing_message
+                            )
+                        
+                        await client.state_manager.start_auto_save(chat_id)
+                        
+                        added_text = client.formatter.format_added_to_queue(
+                            track.to_dict(),
+                            client.localization,
+                            chat_id
                         )
-                    
-                    await client.state_manager.start_auto_save(chat_id)
-                    
+                        await status.send(
+                            added_text + "\n\n🎵 <b>Now Playing!</b>",
+                            reply_markup=client.keyboards.build_playback_controls(
+                                chat_id,
+                                True,
+                                client.localization
+                            )
+                        )
+                    else:
+                        await status.send(
+                            client.localization.get_text(chat_id, "error_messages.general_error", 
+                                                        error="Failed to start playback")
+                        )
+                else:
+                    # Added to queue
                     added_text = client.formatter.format_added_to_queue(
                         track.to_dict(),
                         client.localization,
                         chat_id
                     )
-                    await processing_msg.edit_text(
-                        added_text + "\n\n🎵 <b>Now Playing!</b>",
-                        reply_markup=client.keyboards.build_playback_controls(
+                    await status.send(
+                        added_text,
+                        reply_markup=client.keyboards.build_queue_navigation(
                             chat_id,
-                            True,
+                            0,  # First page
+                            1,  # Will be updated
                             client.localization
-                        )
+                        ) if queue_length > 0 else None
                     )
-                else:
-                    await processing_msg.edit_text(
-                        client.localization.get_text(chat_id, "error_messages.general_error", 
-                                                    error="Failed to start playback")
-                    )
-            else:
-                # Added to queue
-                added_text = client.formatter.format_added_to_queue(
-                    track.to_dict(),
-                    client.localization,
-                    chat_id
-                )
-                await processing_msg.edit_text(
-                    added_text,
-                    reply_markup=client.keyboards.build_queue_navigation(
-                        chat_id,
-                        0,  # First page
-                        1,  # Will be updated
-                        client.localization
-                    ) if queue_length > 0 else None
-                )
             
-            logger.info(f"Added track to queue for chat {chat_id}: {track.title}")
+            logger.info("Added track to queue for chat %s: %s", chat_id, track.title)
             
         except Exception as e:
             logger.error(f"Error in play command for chat {chat_id}: {e}")
-            await processing_msg.edit_text(
+            await status.send(
                 client.localization.get_text(chat_id, "error_messages.general_error", error=str(e))
             )
         
     except Exception as e:
         logger.error(f"Error handling play command: {e}")
-        if 'processing_msg' in locals():
-            await processing_msg.edit_text(
+        if 'status' in locals():
+            await status.send(
                 client.localization.get_text(chat_id, "error_messages.general_error", error=str(e))
             )
 
 
+async def _on_player_back(client: BotClient, callback: CallbackQuery, chat_id: int):
+    """Return to the player view."""
+    await asyncio.gather(
+        client._update_now_playing_message(chat_id),
+        callback.answer("Returned to player")
+    )
+
+
+async def _on_player_pause(client: BotClient, callback: CallbackQuery, chat_id: int):
+    """Pause playback."""
+    if await client.player.pause_playback(chat_id):
+        # The updated message is the confirmation; answer silently
+        await asyncio.gather(
+            client._update_now_playing_message(chat_id),
+            callback.answer(cache_time=CALLBACK_CACHE_TIME)
+        )
+    else:
+        await callback.answer(
+            client.localization.get_text(chat_id, "error_messages.no_active_playback")
+        )
+
+
+async def _on_player_play(client: BotClient, callback: CallbackQuery, chat_id: int):
+    """Resume playback."""
+    if await client.player.resume_playback(chat_id):
+        # The updated message is the confirmation; answer silently
+        await asyncio.gather(
+            client._update_now_playing_message(chat_id),
+            callback.answer(cache_time=CALLBACK_CACHE_TIME)
+        )
+    else:
+        await callback.answer(
+            client.localization.get_text(chat_id, "error_messages.no_active_playback")
+        )
+
+
+async def _on_player_skip(client: BotClient, callback: CallbackQuery, chat_id: int):
+    """Skip the current track."""
+    await _handle_skip(client, chat_id, callback)
+
+
+async def _on_player_stop(client: BotClient, callback: CallbackQuery, chat_id: int):
+    """Stop playback."""
+    await _handle_stop(client, chat_id, callback)
+
+
+# Player callback action -> handler, built once at import
+PLAY_ACTIONS: Dict[str, Callable[[BotClient, CallbackQuery, int], Awaitable[None]]] = {
+    "player_back": _on_player_back,
+    "player_pause": _on_player_pause,
+    "player_play": _on_player_play,
+    "player_skip": _on_player_skip,
+    "player_stop": _on_player_stop,
+}
+
+
 async def play_callback(client: BotClient, callback: CallbackQuery):
     """Handle play-related callbacks."""
     try:
-        from bot.helpers.keyboards import KeyboardBuilder
         data = KeyboardBuilder.parse_callback_data(callback.data)
         
         chat_id = data.get("chat_id", 0)
@@ -170,46 +266,9 @@ async def play_callback(client: BotClient, callback: CallbackQuery):
         if not await _verify_callback_access(client, callback, chat_id):
             return
         
-        action = data["action"]
-        
-        if action == "player_back":
-            # Return to player view
-            await client._update_now_playing_message(chat_id)
-            await callback.answer("Returned to player")
-            
-        elif action == "player_pause":
-            # Pause playback
-            if await client.player.pause_playback(chat_id):
-                # Update message
-                await client._update_now_playing_message(chat_id)
-                await callback.answer(
-                    client.localization.get_text(chat_id, "status_messages.playback_paused")
-                )
-            else:
-                await callback.answer(
-                    client.localization.get_text(chat_id, "error_messages.no_active_playback")
-                )
-                
-        elif action == "player_play":
-            # Resume playback
-            if await client.player.resume_playback(chat_id):
-                # Update message
-                await client._update_now_playing_message(chat_id)
-                await callback.answer(
-                    client.localization.get_text(chat_id, "status_messages.playback_resumed")
-                )
-            else:
-                await callback.answer(
-                    client.localization.get_text(chat_id, "error_messages.no_active_playback")
-                )
-        
-        elif action == "player_skip":
-            # Skip current track
-            await _handle_skip(client, chat_id, callback)
-            
-        elif action == "player_stop":
-            # Stop playback
-            await _handle_stop(client, chat_id, callback)
+        handler = PLAY_ACTIONS.get(data["action"])
+        if handler is not None:
+            await handler(client, callback, chat_id)
         
     except Exception as e:
         logger.error(f"Error handling play callback: {e}")
@@ -219,37 +278,37 @@ async def play_callback(client: BotClient, callback: CallbackQuery):
 async def _handle_skip(client: BotClient, chat_id: int, callback: CallbackQuery):
     """Handle track skipping."""
     try:
-        # Skip current track
-        await client.player.skip_track(chat_id)
-        
-        # Get next track
-        next_track = client.queue_manager.get_next_track(chat_id)
-        
-        if next_track:
-            # Start next track
-            success = await client.player.play_audio(chat_id, next_track.file_path)
+        async with client.queue_manager.lock(chat_id):
+            # Get next track
+            next_track = client.queue_manager.get_next_track(chat_id)
             
-            if success:
-                # Update now playing message
-                await client._update_now_playing_message(chat_id)
+            if next_track:
+                # Start next track (play_audio stops the current one itself)
+                success = await client.player.play_audio(chat_id, next_track.file_path)
                 
-                # Restart progress updater
-                if chat_id in client.player.current_messages:
-                    await client.player.start_progress_updater(
-                        chat_id,
-                        client.player.current_messages[chat_id],
-                        client._update_now_playing_message
+                if success:
+                    # Update now playing message while answering the button
+                    await asyncio.gather(
+                        client._update_now_playing_message(chat_id),
+                        callback.answer(
+                            client.localization.get_text(chat_id, "status_messages.track_skipped")
+                        )
                     )
-                
-                await callback.answer(
-                    client.localization.get_text(chat_id, "status_messages.track_skipped")
-                )
+                    
+                    # Restart progress updater; its first tick is a full interval away
+                    message_id = client.player.current_messages.get(chat_id)
+                    if message_id is not None:
+                        await client.player.start_progress_updater(
+                            chat_id,
+                            message_id,
+                            client._update_now_playing_message
+                        )
+                else:
+                    await callback.answer("Failed to start next track")
             else:
-                await callback.answer("Failed to start next track")
-        else:
-            # No more tracks
-            await client.player.stop_playback(chat_id)
-            await callback.answer("Queue finished")
+                # No more tracks, end the session
+                await client.end_session(chat_id)
+                await callback.answer("Queue finished")
         
     except Exception as e:
         logger.error(f"Error handling skip for chat {chat_id}: {e}")
@@ -259,24 +318,16 @@ async def _handle_skip(client: BotClient, chat_id: int, callback: CallbackQuery)
 async def _handle_stop(client: BotClient, chat_id: int, callback: CallbackQuery):
     """Handle playback stop."""
     try:
-        # Stop playback and leave voice chat
-        await client.player.stop_playback(chat_id)
-        await client.player.leave_voice_chat(chat_id)
-        
-        # Stop auto-save
-        await client.state_manager.stop_auto_save(chat_id)
+        # Leave voice chat, stop auto-save and clear the queue
+        await client.end_session(chat_id)
         
-        # Clear queue
-        client.queue_manager.clear_queue(chat_id)
-        
-        # Update message
-        await callback.message.edit_text(
-            client.localization.get_text(chat_id, "status_messages.left_voice_chat"),
-            reply_markup=None
-        )
-        
-        await callback.answer(
-            client.localization.get_text(chat_id, "status_messages.track_skipped")
+        # Update message while answering the button
+        await asyncio.gather(
+            callback.message.edit_text(
+                client.localization.get_text(chat_id, "status_messages.left_voice_chat"),
+                reply_markup=None
+            ),
+            callback.answer("Playback stopped")
         )
         
     except Exception as e:
@@ -302,6 +353,6 @@ def register_handlers(app: Client, bot_client: BotClient):
     async def handle_play(client: Client, message: Message):
         await play_command(bot_client, message)
     
-    @app.on_callback_query(filters.regex("^player_.*"))
+    @app.on_callback_query(filters.regex("^player_(play|pause|skip|stop|back):"))
     async def handle_play_callback(client: Client, callback: CallbackQuery):
-        await play_callback(bot_client, callback)
+        bot_client.dispatch_callback(callback, play_callback, bot_client, callback)
@@ -1,19 +1,30 @@
 """
 Queue management command handlers.
 """
+import asyncio
 import logging
-from typing import Optional
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
 
 from pyrogram import Client, filters
+from pyrogram.enums import ChatType
 from pyrogram.types import Message, CallbackQuery
 
-from bot.client import BotClient
+from bot.client import BotClient, CALLBACK_CACHE_TIME
+from bot.core.queue import QUEUE_PAGE_SIZE
 from bot.helpers.localization import Localization
 from bot.helpers.keyboards import KeyboardBuilder
 from bot.helpers.formatting import Formatter
 
 logger = logging.getLogger(__name__)
 
+# Formatted queue pages remembered by (chat, page, queue version, current index, language)
+QUEUE_LINES_CACHE_SIZE = 256
+_queue_lines_cache: "OrderedDict[tuple, Tuple[str, ...]]" = OrderedDict()
+
+# One queue track line; the current track gets the ▶️ indicator
+QUEUE_LINE_TEMPLATE = "{indicator}{number}. **{title}**\n   👤 {artist} • ⏱️ {duration}"
+
 
 async def queue_command(client: BotClient, message: Message):
     """Handle /queue command."""
@@ -32,10 +43,9 @@ async def queue_command(client: BotClient, message: Message):
         
         # Calculate pagination
         page = 0
-        page_size = 10
         
         # Get current page
-        page_data = client.queue_manager.get_page(chat_id, page, page_size)
+        page_data = client.queue_manager.get_page(chat_id, page, QUEUE_PAGE_SIZE)
         
         # Format queue header
         queue_header = client.formatter.format_queue_header(
@@ -70,7 +80,7 @@ async def queue_command(client: BotClient, message: Message):
             disable_web_page_preview=True
         )
         
-        logger.info(f"Queue command from chat {chat_id}, {total_tracks} tracks")
+        logger.info("Queue command from chat %s, %s tracks", chat_id, total_tracks)
         
     except Exception as e:
         logger.error(f"Error handling queue command: {e}")
@@ -79,10 +89,28 @@ async def queue_command(client: BotClient, message: Message):
         )
 
 
+async def _on_queue_page(client: BotClient, callback: CallbackQuery, chat_id: int, data: Mapping[str, Any]):
+    """Open, page through or refresh the queue view."""
+    await _show_queue_page(client, chat_id, data.get("page", 0), callback)
+
+
+async def _on_queue_skip(client: BotClient, callback: CallbackQuery, chat_id: int, data: Mapping[str, Any]):
+    """Skip to a specific track."""
+    await _skip_to_track(client, chat_id, data.get("index", 0), callback)
+
+
+# Queue callback action -> handler, built once at import
+QUEUE_ACTIONS: Dict[str, Callable[[BotClient, CallbackQuery, int, Mapping[str, Any]], Awaitable[None]]] = {
+    "queue_open": _on_queue_page,
+    "queue_nav": _on_queue_page,
+    "queue_refresh": _on_queue_page,
+    "queue_skip": _on_queue_skip,
+}
+
+
 async def queue_callback(client: BotClient, callback: CallbackQuery):
     """Handle queue-related callbacks."""
     try:
-        from bot.helpers.keyboards import KeyboardBuilder
         data = KeyboardBuilder.parse_callback_data(callback.data)
         
         chat_id = data.get("chat_id", 0)
@@ -91,26 +119,9 @@ async def queue_callback(client: BotClient, callback: CallbackQuery):
         if not await _verify_callback_access(client, callback, chat_id):
             return
         
-        action = data["action"]
-        
-        if action == "queue_open":
-            # Open queue view
-            page = data.get("page", 0)
-            await _show_queue_page(client, chat_id, page, callback)
-            
-        elif action == "queue_nav":
-            # Navigate queue pages
-            page = data.get("page", 0)
-            await _show_queue_page(client, chat_id, page, callback)
-            
-        elif action == "queue_skip":
-            # Skip to specific track
-            index = data.get("index", 0)
-            await _skip_to_track(client, chat_id, index, callback)
-            
-        elif action == "queue_refresh":
-            # Refresh queue view
-            await queue_callback(client, callback)  # Recursively call with updated data
+        handler = QUEUE_ACTIONS.get(data["action"])
+        if handler is not None:
+            await handler(client, callback, chat_id, data)
         
     except Exception as e:
         logger.error(f"Error handling queue callback: {e}")
@@ -126,7 +137,10 @@ async def _show_queue_page(client: BotClient, chat_id: int, page: int, callback:
         
         if total_tracks == 0:
             empty_text = client.localization.get_text(chat_id, "queue_empty")
-            await callback.message.edit_text(empty_text)
+            await asyncio.gather(
+                callback.message.edit_text(empty_text),
+                callback.answer(cache_time=CALLBACK_CACHE_TIME)
+            )
             return
         
         # Get page data
@@ -159,14 +173,17 @@ async def _show_queue_page(client: BotClient, chat_id: int, page: int, callback:
         # Update message
         full_text = f"{queue_header}\n\n{queue_text}"
         
-        await callback.message.edit_text(
-            full_text,
-            reply_markup=queue_keyboard,
-            disable_web_page_preview=True
+        # Edit and answer are independent requests; send them together. The
+        # page itself is the confirmation, so the answer is silent
+        await asyncio.gather(
+            callback.message.edit_text(
+                full_text,
+                reply_markup=queue_keyboard,
+                disable_web_page_preview=True
+            ),
+            callback.answer(cache_time=CALLBACK_CACHE_TIME)
         )
         
-        await callback.answer(f"Page {page + 1} of {page_data['total_pages']}")
-        
     except Exception as e:
         logger.error(f"Error showing queue page: {e}")
         await callback.answer("❌ Error loading queue")
@@ -184,34 +201,44 @@ async def _format_queue_list(
         if not tracks:
             return "No tracks in this page."
         
-        queue_lines = []
+        offset = page * QUEUE_PAGE_SIZE
         
-        for i, track in enumerate(tracks):
-            global_index = page * 10 + i  # Assuming 10 tracks per page
-            
-            # Format track info
-            title = client.formatter.sanitize_text(track.title, 40)
-            artist = client.formatter.sanitize_text(track.artist, 30)
-            duration = client.formatter.format_duration(track.duration, client.localization, chat_id)
-            
-            # Add current track indicator
-            if global_index == current_index:
-                indicator = "▶️ "
-                format_type = "bold"
-            else:
-                indicator = "  "
-                format_type = "plain"
-            
-            # Format line
-            line = f"{indicator}{global_index + 1}. **{title}**\n   👤 {artist} • ⏱️ {duration}"
-            
-            # For current track, add position
-            if global_index == current_index and client.player:
-                current_pos = int(client.player.get_current_position(chat_id))
-                pos_str = client.formatter.format_duration(current_pos, client.localization, chat_id)
-                line += f" ({pos_str})"
+        # Track lines only change with the queue, so paging back and forth
+        # over an unchanged queue reuses them
+        key = (
+            chat_id,
+            page,
+            client.queue_manager.get_version(chat_id),
+            current_index,
+            client.localization.get_user_language(chat_id)
+        )
+        queue_lines = _queue_lines_cache.get(key)
+        if queue_lines is None:
+            # Bind the per-track helpers once for the whole page
+            sanitize = client.formatter.sanitize_text
+            format_duration = client.localization.get_duration_formatter(chat_id)
             
-            queue_lines.append(line)
+            queue_lines = _queue_lines_cache[key] = tuple(
+                QUEUE_LINE_TEMPLATE.format(
+                    indicator="▶️ " if index == current_index else "  ",
+                    number=index + 1,
+                    title=sanitize(track.title, 40),
+                    artist=sanitize(track.artist, 30),
+                    duration=format_duration(track.duration)
+                )
+                for index, track in enumerate(tracks, offset)
+            )
+            if len(_queue_lines_cache) > QUEUE_LINES_CACHE_SIZE:
+                _queue_lines_cache.popitem(last=False)
+        else:
+            _queue_lines_cache.move_to_end(key)
+        
+        # For current track, add the live position
+        if offset <= current_index < offset + len(queue_lines) and client.player:
+            current_pos = int(client.player.get_current_position(chat_id))
+            pos_str = client.formatter.format_duration(current_pos, client.localization, chat_id)
+            queue_lines = list(queue_lines)
+            queue_lines[current_index - offset] += f" ({pos_str})"
         
         return "\n\n".join(queue_lines)
         
@@ -223,40 +250,40 @@ async def _format_queue_list(
 async def _skip_to_track(client: BotClient, chat_id: int, index: int, callback: CallbackQuery):
     """Skip to specific track in queue."""
     try:
-        # Check if index is valid
-        queue_length = client.queue_manager.get_queue_length(chat_id)
-        if index < 0 or index >= queue_length:
-            await callback.answer("Invalid track index")
-            return
-        
-        # Skip to track
-        track = client.queue_manager.skip_to_track(chat_id, index)
-        
-        if not track:
-            await callback.answer("Track not found")
-            return
-        
-        # Stop current playback
-        await client.player.stop_playback(chat_id)
-        
-        # Start new track
-        success = await client.player.play_audio(chat_id, track.file_path)
-        
-        if success:
-            # Update now playing message
-            await client._update_now_playing_message(chat_id)
+        async with client.queue_manager.lock(chat_id):
+            # Check if index is valid
+            queue_length = client.queue_manager.get_queue_length(chat_id)
+            if index < 0 or index >= queue_length:
+                await callback.answer("Invalid track index")
+                return
             
-            # Restart progress updater
-            if chat_id in client.player.current_messages:
-                await client.player.start_progress_updater(
-                    chat_id,
-                    client.player.current_messages[chat_id],
-                    client._update_now_playing_message
-                )
+            # Skip to track
+            track = client.queue_manager.skip_to_track(chat_id, index)
             
-            await callback.answer(f"Playing track {index + 1}: {track.title[:30]}...")
-        else:
-            await callback.answer("Failed to play track")
+            if not track:
+                await callback.answer("Track not found")
+                return
+            
+            # Start new track (play_audio stops the current one itself)
+            success = await client.player.play_audio(chat_id, track.file_path)
+            
+            if success:
+                # Update now playing message while answering the button
+                await asyncio.gather(
+                    client._update_now_playing_message(chat_id),
+                    callback.answer(f"Playing track {index + 1}: {track.title[:30]}...")
+                )
+                
+                # Restart progress updater
+                message_id = client.player.current_messages.get(chat_id)
+                if message_id is not None:
+                    await client.player.start_progress_updater(
+                        chat_id,
+                        message_id,
+                        client._update_now_playing_message
+                    )
+            else:
+                await callback.answer("Failed to play track")
         
     except Exception as e:
         logger.error(f"Error skipping to track: {e}")
@@ -313,21 +340,15 @@ async def shuffle_queue_command(client: BotClient, message: Message):
 async def _check_admin_privileges(client: BotClient, message: Message) -> bool:
     """Check if user has admin privileges."""
     try:
-        if message.chat.type == "private":
+        if message.chat.type is ChatType.PRIVATE:
             return False
         
-        # Get chat member info
-        chat_member = await client.bot.get_chat_member(
-            message.chat.id, 
-            message.from_user.id
-        )
-        
         # Check if user is admin or owner
-        if chat_member.status in ["administrator", "owner"]:
+        if await client.is_chat_admin(message.chat.id, message.from_user.id):
             return True
         
         # Send admin required message
-        message.reply(
+        await message.reply(
             client.localization.get_text(message.chat.id, "admin_only")
         )
         return False
@@ -362,6 +383,6 @@ def register_handlers(app: Client, bot_client: BotClient):
     async def handle_shuffle(client: Client, message: Message):
         await shuffle_queue_command(bot_client, message)
     
-    @app.on_callback_query(filters.regex("^queue_.*"))
+    @app.on_callback_query(filters.regex("^queue_"))
     async def handle_queue_callback(client: Client, callback: CallbackQuery):
-        await queue_callback(bot_client, callback)
+        bot_client.dispatch_callback(callback, queue_callback, bot_client, callback)
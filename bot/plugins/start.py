@@ -38,7 +38,7 @@ async def start_command(client: BotClient, message: Message):
             disable_web_page_preview=True
         )
         
-        logger.info(f"Start command from chat {chat_id}")
+        logger.info("Start command from chat %s", chat_id)
         
     except Exception as e:
         logger.error(f"Error handling start command: {e}")
@@ -66,7 +66,7 @@ async def help_command(client: BotClient, message: Message):
             disable_web_page_preview=True
         )
         
-        logger.info(f"Help command from chat {chat_id}")
+        logger.info("Help command from chat %s", chat_id)
         
     except Exception as e:
         logger.error(f"Error handling help command: {e}")
@@ -102,7 +102,7 @@ async def language_command(client: BotClient, message: Message):
             reply_markup=language_keyboard
         )
         
-        logger.info(f"Language command from chat {chat_id}")
+        logger.info("Language command from chat %s", chat_id)
         
     except Exception as e:
         logger.error(f"Error handling language command: {e}")
@@ -116,7 +116,6 @@ async def language_callback(client: BotClient, callback: CallbackQuery):
         user_id = callback.from_user.id
         
         # Parse callback data
-        from bot.helpers.keyboards import KeyboardBuilder
         data = KeyboardBuilder.parse_callback_data(callback.data)
         
         if data["action"] == "lang_set" and len(data["params"]) > 0:
@@ -148,7 +147,7 @@ async def language_callback(client: BotClient, callback: CallbackQuery):
             # Answer callback
             await callback.answer(confirm_text)
             
-            logger.info(f"Language changed to {selected_lang} for chat {chat_id}")
+            logger.info("Language changed to %s for chat %s", selected_lang, chat_id)
         else:
             await callback.answer("Invalid language selection")
         
@@ -174,4 +173,4 @@ def register_handlers(app: Client, bot_client: BotClient):
     
     @app.on_callback_query(filters.regex("^lang_set:"))
     async def handle_language_callback(client: Client, callback: CallbackQuery):
-        await language_callback(bot_client, callback)
+        bot_client.dispatch_callback(callback, language_callback, bot_client, callback)
@@ -2,116 +2,108 @@
 Configuration management with environment variables and validation.
 """
 import os
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
 
 from dotenv import load_dotenv
-from pydantic import BaseModel, Field, validator
 
 # Load environment variables
 load_dotenv()
 
+# Accepted values of the enumerated settings
+STORAGE_BACKENDS = frozenset({'memory', 'tinydb', 'sqlite'})  # tinydb is an alias of sqlite
+LOG_LEVELS = frozenset({'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'})
 
-class DatabaseConfig(BaseModel):
+
+@dataclass(slots=True, frozen=True)
+class DatabaseConfig:
     """Database configuration."""
-    backend: str = Field(default="memory", description="Storage backend: memory, tinydb, sqlite")
+    backend: str = "memory"
     
-    @validator('backend')
-    def validate_backend(cls, v):
-        allowed = ['memory', 'tinydb', 'sqlite']
-        if v not in allowed:
-            raise ValueError(f'Backend must be one of {allowed}')
-        return v
+    def __post_init__(self):
+        """Validate the storage backend."""
+        if self.backend not in STORAGE_BACKENDS:
+            raise ValueError(f'Backend must be one of {sorted(STORAGE_BACKENDS)}')
 
 
-class BotConfig(BaseModel):
+@dataclass(slots=True, frozen=True)
+class BotConfig:
     """Bot configuration."""
-    api_id: int = Field(..., description="Telegram API ID")
-    api_hash: str = Field(..., description="Telegram API Hash")
-    bot_token: str = Field(..., description="Bot Token")
-    session_string: str = Field(..., description="Assistant session string")
-    assistant_username: str = Field(..., description="Assistant username")
+    api_id: int
+    api_hash: str
+    bot_token: str
+    session_string: str
+    assistant_username: str
     
-    @validator('api_id')
-    def validate_api_id(cls, v):
-        if not isinstance(v, int) or v <= 0:
+    def __post_init__(self):
+        """Validate the Telegram credentials."""
+        if not isinstance(self.api_id, int) or self.api_id <= 0:
             raise ValueError('API_ID must be a positive integer')
-        return v
-    
-    @validator('bot_token')
-    def validate_bot_token(cls, v):
-        if not v or len(v) < 10:
+        if not self.bot_token or len(self.bot_token) < 10:
             raise ValueError('BOT_TOKEN must be provided and valid')
-        return v
+        for name, value in (
+            ('API_HASH', self.api_hash),
+            ('SESSION_STRING', self.session_string),
+            ('ASSISTANT_USERNAME', self.assistant_username),
+        ):
+            if not value:
+                raise ValueError(f'{name} environment variable is required')
 
 
-class AppConfig(BaseModel):
+@dataclass(slots=True, frozen=True)
+class AppConfig:
     """Application configuration."""
-    download_dir: Path = Field(default="./downloads", description="Download directory")
-    log_level: str = Field(default="INFO", description="Logging level")
-    port: int = Field(default=8080, description="Health check server port")
-    
-    @validator('download_dir')
-    def validate_download_dir(cls, v):
-        path = Path(v)
-        path.mkdir(parents=True, exist_ok=True)
-        return path.absolute()
+    download_dir: Path = Path("./downloads")
+    log_level: str = "INFO"
+    port: int = 8080
     
-    @validator('log_level')
-    def validate_log_level(cls, v):
-        allowed = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
-        if v.upper() not in allowed:
-            raise ValueError(f'LOG_LEVEL must be one of {allowed}')
-        return v.upper()
-    
-    @validator('port')
-    def validate_port(cls, v):
-        if not isinstance(v, int) or v <= 0 or v > 65535:
+    def __post_init__(self):
+        """Validate and normalize application settings."""
+        # Frozen dataclass: normalized values are set through object.__setattr__
+        object.__setattr__(self, 'download_dir', Path(self.download_dir).absolute())
+        
+        log_level = str(self.log_level).upper()
+        if log_level not in LOG_LEVELS:
+            raise ValueError(f'LOG_LEVEL must be one of {sorted(LOG_LEVELS)}')
+        object.__setattr__(self, 'log_level', log_level)
+        
+        if not isinstance(self.port, int) or not 0 < self.port <= 65535:
             raise ValueError('PORT must be a valid port number (1-65535)')
-        return v
 
 
 class Config:
     """Main configuration class."""
     
+    __slots__ = ('bot', 'app', 'database')
+    
     def __init__(self):
+        # Read the environment once; validate() checks the parsed fields
+        env = dict(os.environ)
+        
         self.bot = BotConfig(
-            api_id=int(os.getenv('API_ID', 0)),
-            api_hash=os.getenv('API_HASH', ''),
-            bot_token=os.getenv('BOT_TOKEN', ''),
-            session_string=os.getenv('SESSION_STRING', ''),
-            assistant_username=os.getenv('ASSISTANT_USERNAME', '')
+            api_id=int(env.get('API_ID', 0)),
+            api_hash=env.get('API_HASH', ''),
+            bot_token=env.get('BOT_TOKEN', ''),
+            session_string=env.get('SESSION_STRING', ''),
+            assistant_username=env.get('ASSISTANT_USERNAME', '')
         )
         self.app = AppConfig(
-            download_dir=os.getenv('DOWNLOAD_DIR', './downloads'),
-            log_level=os.getenv('LOG_LEVEL', 'INFO'),
-            port=int(os.getenv('PORT', 8080))
+            download_dir=env.get('DOWNLOAD_DIR', './downloads'),
+            log_level=env.get('LOG_LEVEL', 'INFO'),
+            port=int(env.get('PORT', 8080))
         )
         self.database = DatabaseConfig(
-            backend=os.getenv('STATE_BACKEND', 'memory')
+            backend=env.get('STATE_BACKEND', 'memory')
         )
     
-    def validate(self) -> None:
-        """Validate all configuration values."""
-        try:
-            self.bot.api_id = int(os.getenv('API_ID', 0))
-            if not self.bot.api_id:
-                raise ValueError("API_ID environment variable is required")
-            
-            if not os.getenv('API_HASH'):
-                raise ValueError("API_HASH environment variable is required")
-            
-            if not os.getenv('BOT_TOKEN'):
-                raise ValueError("BOT_TOKEN environment variable is required")
-            
-            if not os.getenv('SESSION_STRING'):
-                raise ValueError("SESSION_STRING environment variable is required")
-            
-            if not os.getenv('ASSISTANT_USERNAME'):
-                raise ValueError("ASSISTANT_USERNAME environment variable is required")
-            
-        except (ValueError, TypeError) as e:
-            raise ValueError(f"Configuration validation failed: {e}")
+    def validate(self) -> "Config":
+        """Validate all configuration values; the sections already checked themselves when built."""
+        return self
+    
+    def ensure_runtime_dirs(self):
+        """Create the directories the bot writes to."""
+        self.app.download_dir.mkdir(parents=True, exist_ok=True)
     
     def __str__(self) -> str:
         return f"""
@@ -125,5 +117,9 @@ Configuration:
         """
 
 
-# Global configuration instance
-config = Config()
+def __getattr__(name: str):
+    """Create the global configuration instance on first use (PEP 562)."""
+    if name == "config":
+        instance = globals()["config"] = Config()
+        return instance
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
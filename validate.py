@@ -3,59 +3,123 @@
 Validation script for Telegram Music Bot MVP v2.1
 Checks if all required files and structure are present.
 """
+import io
 import os
 import json
-from pathlib import Path
+import re
+import sys
+from contextlib import redirect_stdout
 
-def check_file_exists(filepath: str) -> bool:
-    """Check if a file exists."""
-    return Path(filepath).exists()
+# Distribution name at the start of a requirement line
+_REQ_NAME = re.compile(r'[A-Za-z0-9_.\-]+')
+# Repository name of a VCS requirement (git+https://host/owner/name.git@ref)
+_VCS_NAME = re.compile(r'/([A-Za-z0-9_.\-]+?)(?:\.git)?(?:@[^/#]*)?(?:#.*)?$')
 
-def check_directory_exists(dirpath: str) -> bool:
-    """Check if a directory exists."""
-    return Path(dirpath).exists()
+# Files and directories the project must ship, in report order
+REQUIRED_FILES = (
+    "app.py",
+    "config.py",
+    "requirements.txt",
+    ".env.example",
+    "README.md",
+    "bot/__init__.py",
+    "bot/client.py",
+    "bot/core/player.py",
+    "bot/core/queue.py",
+    "bot/helpers/assistant.py",
+    "bot/helpers/keyboards.py",
+    "bot/helpers/localization.py",
+    "bot/helpers/formatting.py",
+    "bot/helpers/youtube.py",
+    "bot/persistence/state.py",
+    "bot/persistence/storage.py",
+    "bot/plugins/start.py",
+    "bot/plugins/play.py",
+    "bot/plugins/controls.py",
+    "bot/plugins/queue.py",
+    "bot/plugins/callbacks.py",
+    "locales/en.json",
+    "locales/ar.json",
+)
+REQUIRED_DIRS = (
+    "bot",
+    "bot/core",
+    "bot/helpers",
+    "bot/persistence",
+    "bot/plugins",
+    "locales",
+)
+
+# Packages requirements.txt must list
+EXPECTED_PACKAGES = frozenset({
+    "pyrogram",
+    "pytgcalls",
+    "tgcrypto",
+    "yt-dlp",
+    "ffmpeg-python",
+    "aiohttp",
+    "aiofiles",
+    "python-dotenv",
+    "motor",
+    "aiosqlite",
+})
+
+# Variables .env.example must define
+EXPECTED_VARS = frozenset({
+    "API_ID",
+    "API_HASH",
+    "BOT_TOKEN",
+    "SESSION_STRING",
+    "ASSISTANT_USERNAME",
+    "DOWNLOAD_DIR",
+    "LOG_LEVEL",
+    "PORT",
+    "STATE_BACKEND",
+})
+
+
+def requirement_name(line: str):
+    """Get the normalized package name of a requirements.txt line."""
+    if "#egg=" in line:
+        name = line.rsplit("#egg=", 1)[1]
+    elif "://" in line:
+        match = _VCS_NAME.search(line)
+        name = match.group(1) if match else None
+    else:
+        match = _REQ_NAME.match(line)
+        name = match.group(0) if match else None
+    return name.lower().replace("_", "-") if name else None
+
+def scan_entries(paths) -> set:
+    """List the parent directory of each path once, returning the paths present."""
+    present = set()
+    for dirpath in {os.path.dirname(path) or "." for path in paths}:
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    present.add(entry.name if dirpath == "." else f"{dirpath}/{entry.name}")
+        except OSError:
+            continue
+    return present
 
 def validate_project():
     """Validate the complete project structure."""
     print("🔍 Validating Telegram Music Bot MVP v2.1...\n")
     
-    required_files = [
-        "app.py",
-        "config.py", 
-        "requirements.txt",
-        ".env.example",
-        "README.md",
-        "bot/__init__.py",
-        "bot/client.py",
-        "bot/core/player.py",
-        "bot/core/queue.py",
-        "bot/helpers/assistant.py",
-        "bot/helpers/keyboards.py",
-        "bot/helpers/localization.py",
-        "bot/helpers/formatting.py",
-        "bot/helpers/youtube.py",
-        "bot/persistence/state.py",
-        "bot/persistence/storage.py",
-        "bot/plugins/start.py",
-        "bot/plugins/play.py",
-        "bot/plugins/controls.py",
-        "bot/plugins/queue.py",
-        "bot/plugins/callbacks.py",
-        "locales/en.json",
-        "locales/ar.json"
-    ]
+    # One directory listing per parent instead of one stat per path
+    present = scan_entries(REQUIRED_FILES + REQUIRED_DIRS)
     
     print("📁 Checking project structure...")
     missing_files = []
-    for file_path in required_files:
-        if check_file_exists(file_path):
+    for file_path in REQUIRED_FILES:
+        if file_path in present:
             print(f"  ✅ {file_path}")
         else:
             print(f"  ❌ {file_path}")
             missing_files.append(file_path)
     
-    print(f"\n📊 Files checked: {len(required_files)}")
-    print(f"✅ Present: {len(required_files) - len(missing_files)}")
+    print(f"\n📊 Files checked: {len(REQUIRED_FILES)}")
+    print(f"✅ Present: {len(REQUIRED_FILES) - len(missing_files)}")
     print(f"❌ Missing: {len(missing_files)}")
     
     if missing_files:
@@ -66,17 +130,8 @@ def validate_project():
     
     # Check directory structure
     print("\n📂 Checking directory structure...")
-    required_dirs = [
-        "bot",
-        "bot/core",
-        "bot/helpers", 
-        "bot/persistence",
-        "bot/plugins",
-        "locales"
-    ]
-    
-    for dir_path in required_dirs:
-        if check_directory_exists(dir_path):
+    for dir_path in REQUIRED_DIRS:
+        if dir_path in present:
             print(f"  ✅ {dir_path}/")
         else:
             print(f"  ❌ {dir_path}/")
@@ -117,31 +172,15 @@ def validate_project():
         with open("requirements.txt", "r") as f:
             requirements = [line.strip() for line in f if line.strip() and not line.startswith("#")]
         
-        expected_packages = [
-            "pyrogram",
-            "pytgcalls", 
-            "tgcrypto",
-            "yt-dlp",
-            "ffmpeg-python",
-            "aiohttp",
-            "aiofiles",
-            "python-dotenv",
-            "pydantic",
-            "motor",
-            "tinydb"
-        ]
-        
-        installed_packages = []
-        for req in requirements:
-            for pkg in expected_packages:
-                if pkg in req:
-                    installed_packages.append(pkg)
+        # One name per line, then set lookups instead of substring scans
+        specified = {requirement_name(req) for req in requirements}
+        installed_packages = EXPECTED_PACKAGES & specified
         
         print(f"  ✅ {len(installed_packages)} core packages specified")
         
-        missing_packages = set(expected_packages) - set(installed_packages)
+        missing_packages = EXPECTED_PACKAGES - installed_packages
         if missing_packages:
-            print(f"  ⚠️  Missing packages: {missing_packages}")
+            print(f"  ⚠️  Missing packages: {sorted(missing_packages)}")
         else:
             print("  ✅ All required packages present")
             
@@ -155,17 +194,11 @@ def validate_project():
         with open(".env.example", "r") as f:
             env_vars = [line.split("=")[0] for line in f if "=" in line and line.strip()]
         
-        expected_vars = [
-            "API_ID", "API_HASH", "BOT_TOKEN", 
-            "SESSION_STRING", "ASSISTANT_USERNAME",
-            "DOWNLOAD_DIR", "LOG_LEVEL", "PORT", "STATE_BACKEND"
-        ]
-        
         print(f"  ✅ {len(env_vars)} environment variables defined")
         
-        missing_vars = set(expected_vars) - set(env_vars)
+        missing_vars = EXPECTED_VARS.difference(env_vars)
         if missing_vars:
-            print(f"  ⚠️  Missing variables: {missing_vars}")
+            print(f"  ⚠️  Missing variables: {sorted(missing_vars)}")
         else:
             print("  ✅ All required variables present")
             
@@ -187,4 +220,10 @@ def validate_project():
     return True
 
 if __name__ == "__main__":
-    validate_project()
+    # Collect the report and write it out in one go rather than line by line
+    report = io.StringIO()
+    try:
+        with redirect_stdout(report):
+            validate_project()
+    finally:
+        sys.stdout.write(report.getvalue())